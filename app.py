@@ -1,48 +1,127 @@
 # app.py
+import time
+
+STARTED_AT = time.perf_counter()  # taken before the imports below, so they are timed too
+
 import asyncio
+import importlib
+import logging
+import os
+import signal
 import config
-import threading
+import logging_config
+import metrics
 from tcp_server import TCPServer
-from state.session import SessionManager
-from players.upnp_player import UPnPPlayer
-from players.shairport_player import ShairportPlayer
-from web.endpoints import app  # Still need Flask for the /art endpoint
+from state.session import SessionManager, ART_CACHE_DIR
+from state.art_fetcher import ArtFetcher
+from state.art_cache import ArtCache
+from state.art_processor import validate_variants
+from players.plugins import load_players, validate_players
+
+logger = logging.getLogger(__name__)
 
+STARTUP_SECONDS = metrics.Gauge(
+    "apollo_startup_seconds", "Time from service start to each startup step.", ["step"])
 
-def run_flask():
-    app.run(host=config.WEB_SERVER_HOST,
-            port=config.WEB_SERVER_PORT)
 
+def _startup_step(step):
+    elapsed = time.perf_counter() - STARTED_AT
+    STARTUP_SECONDS.labels(step).set(elapsed)
+    logger.info("Startup: %s after %.0f ms.", step, elapsed * 1000)
 
-async def main(loop):
+
+async def main():
+    loop = asyncio.get_running_loop()
+    # systemd stops the service with SIGTERM; unwind like on Ctrl-C.
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    validate_variants(config.ART_VARIANTS)
+    validate_players(config.PLAYERS)
+    _startup_step("imports")
+    art_cache = ArtCache(
+        ART_CACHE_DIR,
+        disk_budget=config.ART_CACHE_DISK_BUDGET,
+        memory_budget=config.ART_CACHE_MEMORY_BUDGET,
+    )
     tcp_server = TCPServer(
         config.WEB_SERVER_HOST,
         config.TCP_SERVER_PORT,
+        queue_size=config.TCP_CLIENT_QUEUE_SIZE,
+        write_timeout=config.TCP_CLIENT_WRITE_TIMEOUT,
+        hello_timeout=config.TCP_HELLO_TIMEOUT,
+        art_cache=art_cache,
+        art_variants=config.ART_VARIANTS,
+        art_chunk_size=config.TCP_ART_CHUNK_SIZE,
+        default_zones=config.TCP_DEFAULT_ZONES,
+        started_at=STARTED_AT,
+        zones=[entry["zone"] for entry in config.PLAYERS],
     )
-    session_manager = SessionManager(tcp_server, loop)
-
-    upnp_player = UPnPPlayer(
-        renderer_name=config.TARGET_RENDERER_NAME,
-        session_manager=session_manager
+    art_fetcher = ArtFetcher(
+        os.path.join(ART_CACHE_DIR, "validators.json"),
+        limit_per_host=config.ART_HTTP_LIMIT_PER_HOST,
+        timeout=config.ART_HTTP_TIMEOUT,
+        revalidate_after=config.ART_REVALIDATE_AFTER,
     )
-
-    shairport_player = ShairportPlayer(
-        session_manager=session_manager,
-        pipe_path="/tmp/shairport-sync-metadata"
+    session_manager = SessionManager(
+        tcp_server, loop,
+        coalesce_window_ms=config.SESSION_COALESCE_WINDOW_MS,
+        art_workers=config.ART_WORKERS,
+        art_fetcher=art_fetcher,
+        art_cache=art_cache,
+        art_variants=config.ART_VARIANTS,
+        render_processes=config.ART_RENDER_PROCESSES,
+        snapshot_path=config.SESSION_SNAPSHOT_PATH,
+        snapshot_interval=config.SESSION_SNAPSHOT_INTERVAL,
+        snapshot_max_age=config.SESSION_SNAPSHOT_MAX_AGE,
     )
 
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
+    # Boards get the last known state first; everything after this can take
+    # its time without leaving them blank.
+    restored = await session_manager.restore_snapshot({entry["zone"] for entry in config.PLAYERS})
+    logger.info("Restored %d zone(s) from the state snapshot.", restored)
+    await tcp_server.listen()
+    _startup_step("listening")
+
+    players = await load_players(config.PLAYERS, session_manager, defaults={
+        "upnp": {
+            "renderer_cache_path": config.UPNP_RENDERER_CACHE,
+            "subscription_timeout": config.UPNP_SUBSCRIPTION_TIMEOUT,
+            "liveness_timeout": config.UPNP_LIVENESS_TIMEOUT,
+            "prefetch_tracks": config.UPNP_PREFETCH_TRACKS,
+        },
+    })
 
-    await asyncio.gather(
-        tcp_server.start(),
-        upnp_player.start(),
-        shairport_player.start()
+    # aiohttp's server is a heavy import; load it off the loop too.
+    endpoints = await loop.run_in_executor(None, importlib.import_module, "web.endpoints")
+    web_server = endpoints.WebServer(
+        config.WEB_SERVER_HOST,
+        config.WEB_SERVER_PORT,
+        art_cache,
+        art_variants=config.ART_VARIANTS,
     )
+    _startup_step("players loaded")
+
+    try:
+        await asyncio.gather(
+            session_manager.run(),
+            tcp_server.start(),
+            web_server.start(),
+            *(player.start() for player in players),
+        )
+    finally:
+        await art_fetcher.close()
+        art_cache.save()
+        session_manager.save_snapshot()
 
 if __name__ == '__main__':
+    logging_config.setup(
+        config.LOG_LEVEL, config.LOG_LEVELS,
+        rate=config.LOG_RATE_LIMIT,
+        burst=config.LOG_RATE_BURST,
+        sample_every=config.LOG_SAMPLE_EVERY,
+    )
     try:
-        main_loop = asyncio.get_event_loop()
-        main_loop.run_until_complete(main(main_loop))
-    except KeyboardInterrupt:
-        print("Service stopped.")
+        asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logger.info("Service stopped.")
+    finally:
+        logging_config.shutdown()
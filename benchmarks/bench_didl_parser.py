@@ -0,0 +1,78 @@
+# benchmarks/bench_didl_parser.py
+"""Cost of parsing UPnP DIDL-Lite track metadata.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_didl_parser
+
+Replays the recorded DIDL-Lite documents in benchmarks/samples/didl/. The
+legacy column rebuilds the namespace map and runs the old `//` queries on
+every call, cold runs the precompiled child-path queries with the cache
+cleared, and cached is the steady state where renderers resend the same
+Metadata string.
+"""
+import argparse
+import glob
+import os
+import time
+from lxml import etree
+from players import didl_parser
+from players.didl_parser import parse_didl_metadata
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "samples", "didl")
+
+
+def load_samples():
+    samples = {}
+    for path in sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.xml"))):
+        with open(path, encoding="utf-8") as f:
+            samples[os.path.basename(path)] = f.read()
+    return samples
+
+
+def parse_legacy(track_metadata_xml):
+    root = etree.fromstring(track_metadata_xml.encode("utf-8"))
+    ns = {'dc': 'http://purl.org/dc/elements/1.1/', 'upnp': 'urn:schemas-upnp-org:metadata-1-0/upnp/'}
+    title = root.xpath("//dc:title/text()", namespaces=ns)
+    artist = root.xpath("//upnp:artist/text()", namespaces=ns)
+    cover_art = root.xpath("//upnp:albumArtURI/text()", namespaces=ns)
+    songid = root.xpath("//@id", namespaces=ns)
+    return {
+        "title": title[0] if title else None,
+        "artist": artist[0] if artist else None,
+        "cover_url": cover_art[0] if cover_art else None,
+        "songid": songid[0] if songid else None,
+    }
+
+
+def parse_cold(track_metadata_xml):
+    didl_parser._parse_cached.cache_clear()
+    return parse_didl_metadata(track_metadata_xml)
+
+
+def measure(func, document, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func(document)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'sample':<22} {'legacy us':>10} {'cold us':>10} {'cached us':>10}")
+    for name, document in load_samples().items():
+        expected = {key: str(value) if value is not None else None
+                    for key, value in parse_legacy(document).items()}
+        assert parse_cold(document) == expected, f"{name}: parsed fields differ from legacy"
+
+        legacy = measure(parse_legacy, document, args.iterations)
+        cold = measure(parse_cold, document, args.iterations)
+        cached = measure(parse_didl_metadata, document, args.iterations)
+        print(f"{name:<22} {legacy:>10.2f} {cold:>10.2f} {cached:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
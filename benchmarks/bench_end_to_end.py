@@ -0,0 +1,434 @@
+# benchmarks/bench_end_to_end.py
+"""Event-to-board latency of the whole service, from player input to TCP frame.
+
+Run from the repository root on Linux:
+
+    python -m benchmarks.bench_end_to_end --source upnp --rates 10,100 --clients 1,20
+
+Each run starts a real SessionManager and TCPServer on a free local port,
+connects N simulated boards and feeds track changes from one source:
+
+* mock       MockPlayer firing from its own thread at the given rate
+* upnp       synthetic DIDL-Lite events passed to UPnPPlayer._event_callback
+* shairport  metadata items (optionally with a PICT) written into a FIFO read
+             by ShairportPlayer; --stream replays the items of a recorded
+             pipe capture instead
+* mpd        track changes on an in-process FakeMPD, followed by MPDPlayer
+             over a real socket; --pict-bytes sets the cover it reads
+
+With --zones N the upnp and mock events rotate over N zones and each board
+subscribes to one of them, so fan-out only reaches that zone's boards. The
+shairport and mpd sources always feed a single zone.
+
+Every event carries a unique title, so a board can match the first frame
+showing that title to the moment the event was injected. With --pict-bytes,
+every shairport/mpd track also carries its own JPEG cover, and the time until
+a board sees that track's cover_url is reported separately. That includes
+the decode, resize, encode and cache store of the whole art pipeline. Events collapsed by
+the session's coalescing window count as not delivered. Boards run in the
+same process and share its event loop and memory, so treat the numbers as a
+relative measure between runs, not as a board's view of a production server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import struct
+import tempfile
+import threading
+import time
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+import logging_config
+from benchmarks.bench_shairport_parser import make_item
+from benchmarks.fake_mpd import FakeMPD
+from players.mock_player import MockPlayer
+from players.mpd_player import MPDPlayer
+from players.shairport_parser import ShairportParser
+from players.shairport_player import ShairportPlayer
+from players.upnp_player import UPnPPlayer
+from state.art_cache import ArtCache
+from state.art_processor import render_source
+from state.session import SessionManager
+from tcp_server import BINARY_FRAME_FLAG, DEFAULT_HELLO_TIMEOUT, TCPServer
+
+MARKER = "bench-"
+DRAIN_TIME = 1.0
+
+DIDL_TEMPLATE = (
+    '<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+    'xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/">'
+    '<item id="bench{n}" parentID="0" restricted="1"><dc:title>{title}</dc:title>'
+    '<upnp:artist>Benchmark</upnp:artist><upnp:album>Synthetic</upnp:album>'
+    '<upnp:class>object.item.audioItem.musicTrack</upnp:class></item></DIDL-Lite>')
+
+
+class _StateVar:
+    """Stands in for async_upnp_client's UpnpStateVariable in _event_callback."""
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+
+def rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def load_recorded_tracks(path):
+    """Splits a raw pipe capture into per-track item lists, starting at each mdst."""
+    with open(path, "rb") as f:
+        items = ShairportParser().feed(f.read())
+    tracks, current = [], []
+    for code, value in items:
+        if code == "mdst" and current:
+            tracks.append(current)
+            current = []
+        current.append((code, value))
+    if current:
+        tracks.append(current)
+    return [track for track in tracks if any(code == "minm" for code, _ in track)]
+
+
+def synthetic_cover(size):
+    """A real JPEG of roughly `size` bytes. It is noise, so it barely compresses."""
+    from PIL import Image
+    side = max(16, int((size / 1.5) ** 0.5))
+    for _ in range(3):
+        image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+        output = BytesIO()
+        image.save(output, "JPEG", quality=90)
+        data = output.getvalue()
+        side = max(16, int(side * (size / len(data)) ** 0.5))
+    return data
+
+
+def track_cover(cover, n):
+    """Makes each track's cover unique, so every track misses the art cache.
+
+    Image decoders ignore bytes after the end of the image.
+    """
+    return cover + b"%d" % n
+
+
+def synthetic_tracks(pict_bytes):
+    track = [("mdst", b"1"), ("asar", b"Benchmark"), ("minm", b"")]
+    if pict_bytes:
+        # Before the title, so the track commits once with its cover.
+        track.insert(1, ("PICT", synthetic_cover(pict_bytes)))
+    return [track]
+
+
+def encode_track(track, title, n):
+    def value_of(code, value):
+        if code == "minm":
+            return title.encode()
+        if code == "PICT" and value:
+            return track_cover(value, n)
+        return value or b""
+    return b"".join(make_item(code, value_of(code, value)) for code, value in track)
+
+
+class Board:
+    """A simulated board: one TCP connection recording when each marked title arrives."""
+
+    def __init__(self, sent_at, mode, zone=None):
+        self._sent_at = sent_at
+        self._mode = mode
+        self.zone = zone
+        self.latencies = []
+        self.cover_latencies = []
+        self.frames = 0
+        self.art_bytes = 0
+        self._seen = set()
+        self._covered = set()
+        self._states = {}  # zone -> state, with delta frames applied
+
+    def _record(self, state, received_at):
+        title = state.get("title")
+        if not title or not title.startswith(MARKER):
+            return
+        sent_at = self._sent_at.get(title)
+        if sent_at is None:
+            return
+        if title not in self._seen:
+            self._seen.add(title)
+            self.latencies.append(received_at - sent_at)
+        if state.get("cover_url") and title not in self._covered:
+            self._covered.add(title)
+            self.cover_latencies.append(received_at - sent_at)
+
+    async def run(self, port, connected):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        if self._mode == "delta" or self.zone:
+            hello = {"mode": self._mode}
+            if self.zone:
+                hello["zones"] = [self.zone]
+            hello = json.dumps(hello).encode()
+            writer.write(struct.pack(">I", len(hello)) + hello)
+        connected.release()
+        try:
+            while True:
+                (length,) = struct.unpack(">I", await reader.readexactly(4))
+                payload = await reader.readexactly(length & ~BINARY_FRAME_FLAG)
+                received_at = time.perf_counter()
+                self.frames += 1
+                if length & BINARY_FRAME_FLAG:
+                    self.art_bytes += len(payload)
+                    continue
+                message = json.loads(payload)
+                if message.get("type") == "snapshot":
+                    self._states[message.get("zone")] = dict(message["state"])
+                    self._record(message["state"], received_at)
+                elif message.get("type") == "delta":
+                    state = self._states.setdefault(message.get("zone"), {})
+                    state.update(message["changes"])
+                    self._record(state, received_at)
+                elif "type" not in message:
+                    self._record(message, received_at)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def pace(rate, count, inject):
+    """Calls inject(n) `count` times at `rate` per second without drifting."""
+    interval = 1 / rate
+    next_at = time.perf_counter()
+    for n in range(count):
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        inject(n)
+        next_at += interval
+
+
+def zone_name(n, zones):
+    return f"zone{n % zones}"
+
+
+async def drive_upnp(session_manager, rate, count, sent_at, zones):
+    players = [UPnPPlayer("bench renderer", session_manager, name=zone_name(n, zones))
+               for n in range(zones)]
+
+    def inject(n):
+        player = players[n % zones]
+        title = f"{MARKER}{n}"
+        metadata = DIDL_TEMPLATE.format(n=n, title=escape(title))
+        sent_at[title] = time.perf_counter()
+        player._event_callback(None, [_StateVar("TransportState", "Playing"),
+                                      _StateVar("Metadata", metadata)])
+
+    await pace(rate, count, inject)
+
+
+async def drive_mock(session_manager, rate, count, sent_at, zones):
+    states = [{"player_state": "playing", "artist": "Benchmark", "album": "Synthetic",
+               "title": f"{MARKER}{n}", "songid": f"mock-{n}", "zone": zone_name(n, zones)}
+              for n in range(count)]
+    done = threading.Event()
+
+    def on_state_change(name, state):
+        if state["title"] in sent_at:
+            done.set()  # Wrapped around, every state has been sent once
+            return
+        sent_at[state["title"]] = time.perf_counter()
+        session_manager.update_metadata(state["zone"], state)
+
+    player = MockPlayer(on_state_change, interval=1 / rate, states=states, start_delay=0)
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, done.wait, count / rate + 5)
+    finally:
+        player.stop()
+
+
+async def drive_shairport(session_manager, rate, count, sent_at, tracks):
+    fifo_dir = tempfile.mkdtemp()
+    fifo_path = os.path.join(fifo_dir, "shairport-sync-metadata")
+    os.mkfifo(fifo_path)
+    player = ShairportPlayer(fifo_path, session_manager)
+    reader_task = asyncio.get_running_loop().create_task(player.start())
+    # Opening the write end blocks until ShairportPlayer has opened the read end.
+    pipe = await asyncio.get_running_loop().run_in_executor(None, open, fifo_path, "wb", 0)
+
+    def write_track(n):
+        title = f"{MARKER}{n}"
+        data = encode_track(tracks[n % len(tracks)], title, n)
+        sent_at[title] = time.perf_counter()
+        pipe.write(data)
+
+    # One writer thread keeps tracks in order; a big PICT blocking on a full
+    # pipe then delays later writes, not the pacing of the loop.
+    writer = ThreadPoolExecutor(max_workers=1)
+    try:
+        await pace(rate, count, lambda n: writer.submit(write_track, n))
+        await asyncio.get_running_loop().run_in_executor(None, writer.shutdown)
+    finally:
+        pipe.close()
+        reader_task.cancel()
+        os.unlink(fifo_path)
+        os.rmdir(fifo_dir)
+
+
+async def drive_mpd(session_manager, rate, count, sent_at, pict_bytes):
+    cover = synthetic_cover(pict_bytes) if pict_bytes else None
+    fake = FakeMPD()
+    server = await asyncio.start_server(fake.handle, "127.0.0.1", 0)
+    player = MPDPlayer(session_manager, "127.0.0.1", server.sockets[0].getsockname()[1])
+    player_task = asyncio.get_running_loop().create_task(player.start())
+    while not fake.clients:
+        await asyncio.sleep(0.01)
+
+    def play(n):
+        title = f"{MARKER}{n}"
+        sent_at[title] = time.perf_counter()
+        # A new album and cover each time, so every track reads its cover
+        # over the socket and renders it.
+        fake.cover = track_cover(cover, n) if cover else None
+        fake.play(title, album=f"Album {n}")
+
+    try:
+        await pace(rate, count, play)
+        while not fake.settled:
+            await asyncio.sleep(0.01)
+    finally:
+        player_task.cancel()
+        server.close()
+
+
+async def run_once(args, rate, clients):
+    sent_at = {}
+    count = max(1, int(rate * args.duration))
+    port = free_port()
+    cache_dir = tempfile.mkdtemp()
+    loop = asyncio.get_running_loop()
+
+    zones = args.zones if args.source in ("upnp", "mock") else 1
+    art_cache = ArtCache(cache_dir)
+    tcp_server = TCPServer("127.0.0.1", port, art_cache=art_cache,
+                           zones=[zone_name(n, zones) for n in range(zones)])
+    session_manager = SessionManager(
+        tcp_server, loop, coalesce_window_ms=args.coalesce_ms,
+        art_cache=art_cache, render_processes=args.render_processes)
+    tasks = [loop.create_task(session_manager.run()), loop.create_task(tcp_server.start())]
+    if session_manager._render_pool:
+        # Start the render workers now, so the first covers don't measure it.
+        warmup = synthetic_cover(1000)
+        await asyncio.gather(*(loop.run_in_executor(session_manager._render_pool, render_source, warmup, {})
+                               for _ in range(args.render_processes)))
+    await asyncio.sleep(0.1)
+
+    boards = [Board(sent_at, args.mode, zone_name(n, zones) if zones > 1 else None)
+              for n in range(clients)]
+    connected = asyncio.Semaphore(0)
+    board_tasks = [loop.create_task(board.run(port, connected)) for board in boards]
+    for _ in boards:
+        await connected.acquire()
+    # Full mode boards send no hello; let the server stop waiting for one
+    # so the first events don't measure the hello timeout.
+    await asyncio.sleep(DEFAULT_HELLO_TIMEOUT + 0.1)
+
+    rss_before = rss_kb()
+    started = time.perf_counter()
+    if args.source == "upnp":
+        await drive_upnp(session_manager, rate, count, sent_at, zones)
+    elif args.source == "mock":
+        await drive_mock(session_manager, rate, count, sent_at, zones)
+    elif args.source == "mpd":
+        await drive_mpd(session_manager, rate, count, sent_at, args.pict_bytes)
+    else:
+        tracks = load_recorded_tracks(args.stream) if args.stream else synthetic_tracks(args.pict_bytes)
+        await drive_shairport(session_manager, rate, count, sent_at, tracks)
+    injected_for = time.perf_counter() - started
+    await asyncio.sleep(DRAIN_TIME)
+    rss_after = rss_kb()
+
+    # Disconnect the boards first so the server's handlers end on EOF.
+    for task in board_tasks + tasks:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0.05)
+    if session_manager._render_pool:
+        session_manager._render_pool.shutdown()
+
+    latencies = [latency for board in boards for latency in board.latencies]
+    cover_latencies = [latency for board in boards for latency in board.cover_latencies]
+    # A board only expects the events of the zone it follows.
+    expected = sum(len(sent_at) if board.zone is None
+                   else sum(1 for n in range(len(sent_at)) if zone_name(n, zones) == board.zone)
+                   for board in boards)
+    delivered = sum(len(board.latencies) for board in boards) / (expected or 1)
+    return {
+        "events": len(sent_at),
+        "event_rate": len(sent_at) / injected_for,
+        "frames_per_s": sum(board.frames for board in boards) / (injected_for + DRAIN_TIME),
+        "delivered": delivered,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "covers": sum(len(board.cover_latencies) for board in boards) / (expected or 1),
+        "cover_p50_ms": percentile(cover_latencies, 50) * 1000,
+        "cover_p99_ms": percentile(cover_latencies, 99) * 1000,
+        "rss_mb": rss_after / 1024,
+        "rss_growth_mb": (rss_after - rss_before) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", choices=("mock", "upnp", "shairport", "mpd"), default="upnp")
+    parser.add_argument("--rates", default="10,100", help="comma separated events per second")
+    parser.add_argument("--clients", default="1,10", help="comma separated board counts")
+    parser.add_argument("--duration", type=float, default=5, help="seconds of events per run")
+    parser.add_argument("--mode", choices=("full", "delta"), default="full")
+    parser.add_argument("--zones", type=int, default=1,
+                        help="zones the upnp/mock events rotate over, one per board")
+    parser.add_argument("--coalesce-ms", type=int, default=0,
+                        help="session coalescing window; 0 broadcasts every event")
+    parser.add_argument("--pict-bytes", type=int, default=0,
+                        help="synthetic cover size per shairport/mpd track, 0 for none")
+    parser.add_argument("--stream", help="recorded shairport pipe capture to replay")
+    parser.add_argument("--render-processes", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="keep the service's own output")
+    args = parser.parse_args()
+    # The service's logging goes through the same queue and writer thread
+    # as in production, just quieter unless asked for.
+    logging_config.setup("DEBUG" if args.verbose else "ERROR")
+
+    print(f"{'rate/s':>7} {'boards':>6} {'events':>7} {'got/s':>8} {'frames/s':>9} "
+          f"{'delivered':>9} {'p50 ms':>8} {'p99 ms':>8} {'covers':>7} {'art p50':>8} {'art p99':>8} "
+          f"{'rss MB':>7} {'+rss MB':>7}")
+    for rate in (float(value) for value in args.rates.split(",")):
+        for clients in (int(value) for value in args.clients.split(",")):
+            result = asyncio.run(run_once(args, rate, clients))
+            print(f"{rate:>7g} {clients:>6} {result['events']:>7} {result['event_rate']:>8.1f} "
+                  f"{result['frames_per_s']:>9.1f} {result['delivered']:>9.1%} "
+                  f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['covers']:>7.1%} "
+                  f"{result['cover_p50_ms']:>8.2f} {result['cover_p99_ms']:>8.2f} "
+                  f"{result['rss_mb']:>7.1f} {result['rss_growth_mb']:>7.1f}")
+    print(f"peak rss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# benchmarks/bench_shairport_parser.py
+"""Throughput of the Shairport metadata parser on large PICT payloads.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_shairport_parser
+
+For each PICT size the stream is fed in pipe-sized chunks. Linear parsing
+shows up as a flat MB/s column as the payload grows. The legacy column
+replays the old str buffer handling (find from the start, re-slice per
+item, decode the whole payload at the end) for comparison.
+"""
+import argparse
+import base64
+import os
+import time
+from players.shairport_parser import ShairportParser
+
+
+def make_item(code, payload):
+    encoded = base64.encodebytes(payload).decode()
+    return (f"<item><type>636f7265</type><code>{code.encode().hex()}</code>"
+            f"<length>{len(payload)}</length>\n<data encoding=\"base64\">\n"
+            f"{encoded}</data></item>\n").encode()
+
+
+def make_stream(pict_size):
+    pict = os.urandom(pict_size)
+    stream = b"".join([
+        make_item("mdst", b"1"),
+        make_item("asar", b"Daft Punk"),
+        make_item("minm", b"One More Time"),
+        make_item("PICT", pict),
+        make_item("prsm", b""),
+    ])
+    return stream, pict
+
+
+def run_parser(stream, chunk_size):
+    parser = ShairportParser()
+    items = []
+    for offset in range(0, len(stream), chunk_size):
+        items.extend(parser.feed(stream[offset:offset + chunk_size]))
+    return items
+
+
+def run_legacy(stream, chunk_size):
+    buffer = ""
+    items = []
+    for offset in range(0, len(stream), chunk_size):
+        buffer += stream[offset:offset + chunk_size].decode('utf-8', 'ignore')
+        while True:
+            start_index = buffer.find("<item>")
+            end_index = buffer.find("</item>")
+            if start_index == -1 or end_index <= start_index:
+                break
+            item = buffer[start_index:end_index + len("</item>")]
+            buffer = buffer[end_index + len("</item>"):]
+            data = item.split('encoding="base64">', 1)[-1].split("</data>", 1)[0]
+            items.append(base64.b64decode(data.strip()) if "<data" in item else None)
+    return items
+
+
+def measure(func, stream, chunk_size, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(stream, chunk_size)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="65536,262144,1048576,4194304",
+                        help="comma separated PICT sizes in bytes")
+    parser.add_argument("--chunks", default="4096,65536",
+                        help="comma separated pipe read sizes in bytes")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    print(f"{'pict bytes':>12} {'read size':>10} {'parser MB/s':>12} {'legacy MB/s':>12}")
+    for pict_size in (int(size) for size in args.sizes.split(",")):
+        stream, pict = make_stream(pict_size)
+        items = dict(run_parser(stream, 4096))
+        assert items["PICT"] == pict, "PICT payload did not round-trip"
+        megabytes = len(stream) / (1024 * 1024)
+
+        for chunk_size in (int(chunk) for chunk in args.chunks.split(",")):
+            parser_mbs = megabytes / measure(run_parser, stream, chunk_size, args.repeat)
+            legacy = "-"
+            if not args.skip_legacy:
+                legacy = f"{megabytes / measure(run_legacy, stream, chunk_size, 1):.1f}"
+            print(f"{pict_size:>12} {chunk_size:>10} {parser_mbs:>12.1f} {legacy:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+# benchmarks/fake_mpd.py
+"""A fake MPD server to run MPDPlayer against without a real MPD.
+
+Run from the repository root, then point a PLAYERS entry at it:
+
+    python -m benchmarks.fake_mpd --port 6601 --interval 5 --cover cover.jpg
+
+It speaks the part of the protocol MPDPlayer uses: the greeting, password,
+binarylimit, command lists, idle/noidle, status, currentsong, readpicture
+and albumart. Like MPD, a change made while a client isn't idling is kept
+and returned by that client's next idle. Standalone, it starts a new track
+every --interval seconds; bench_end_to_end drives FakeMPD.play() directly.
+"""
+import argparse
+import asyncio
+import shlex
+
+PROTOCOL_VERSION = "0.23.5"
+DEFAULT_BINARY_LIMIT = 8192
+
+ACK_ARG = 2
+ACK_PASSWORD = 3
+ACK_PERMISSION = 4
+ACK_UNKNOWN = 5
+ACK_NO_EXIST = 50
+
+
+class _Ack(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class _Connection:
+    def __init__(self, authorized):
+        self.authorized = authorized
+        self.binary_limit = DEFAULT_BINARY_LIMIT
+        self.changed = asyncio.Event()
+        self.next_line = None  # read while idling, before the change won
+        self.idling = False
+
+
+class FakeMPD:
+    """In-memory MPD with one current song. `cover` is served by readpicture if
+    `embedded`, otherwise by albumart, as MPD does for a folder cover file."""
+
+    def __init__(self, password=None, cover=None, embedded=True):
+        self.password = password
+        self.cover = cover
+        self.embedded = embedded
+        self.state = "stop"
+        self.song = {}
+        self.cover_reads = 0  # picture commands answered, for checking cover reuse
+        self._next_id = 1
+        self._connections = set()
+
+    @property
+    def clients(self):
+        return len(self._connections)
+
+    @property
+    def settled(self):
+        """True once every client has seen the last change and is idling again."""
+        return all(connection.idling and not connection.changed.is_set()
+                   for connection in self._connections)
+
+    def play(self, title, artist="Fake Artist", album="Fake Album", file=None):
+        song_id = self._next_id
+        self._next_id += 1
+        self.song = {
+            "file": file or f"{artist}/{album}/{song_id:04d}.flac",
+            "Title": title,
+            "Artist": artist,
+            "Album": album,
+            "Id": str(song_id),
+        }
+        self.state = "play"
+        self._notify()
+
+    def pause(self):
+        self.state = "pause"
+        self._notify()
+
+    def stop(self):
+        self.state = "stop"
+        self._notify()
+
+    def _notify(self):
+        for connection in self._connections:
+            connection.changed.set()
+
+    def _picture(self, connection, args, available):
+        if len(args) != 2 or not args[1].isdigit():
+            raise _Ack(ACK_ARG, "Expected a uri and an offset")
+        if not available or not self.cover:
+            return None
+        offset = int(args[1])
+        chunk = self.cover[offset:offset + connection.binary_limit]
+        self.cover_reads += 1
+        return f"size: {len(self.cover)}\ntype: image/jpeg\nbinary: {len(chunk)}\n".encode() + chunk + b"\n"
+
+    def _execute(self, connection, line):
+        """Returns the response body for one command, without the final OK."""
+        command, *args = shlex.split(line)
+        if not connection.authorized and command not in ("password", "ping"):
+            raise _Ack(ACK_PERMISSION, f'you don\'t have permission for "{command}"')
+        if command == "ping":
+            return b""
+        if command == "password":
+            if args != [self.password]:
+                raise _Ack(ACK_PASSWORD, "incorrect password")
+            connection.authorized = True
+            return b""
+        if command == "binarylimit":
+            connection.binary_limit = max(64, int(args[0]))
+            return b""
+        if command == "status":
+            lines = ["volume: 100", f"state: {self.state}"]
+            if self.song:
+                lines.append(f"songid: {self.song['Id']}")
+            return "".join(f"{line}\n" for line in lines).encode()
+        if command == "currentsong":
+            return "".join(f"{key}: {value}\n" for key, value in self.song.items()).encode()
+        if command == "readpicture":
+            return self._picture(connection, args, self.embedded) or b""
+        if command == "albumart":
+            body = self._picture(connection, args, not self.embedded)
+            if body is None:
+                raise _Ack(ACK_NO_EXIST, "No file exists")
+            return body
+        raise _Ack(ACK_UNKNOWN, f'unknown command "{command}"')
+
+    async def _idle(self, connection, reader, writer):
+        """Answers idle when something changes, or noidle when the client gives up."""
+        waiter = asyncio.ensure_future(connection.changed.wait())
+        reading = asyncio.ensure_future(reader.readline())
+        connection.idling = True
+        try:
+            done, _ = await asyncio.wait({waiter, reading}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            connection.idling = False
+        if waiter in done:
+            connection.changed.clear()
+            writer.write(b"changed: player\nOK\n")
+            reading.cancel()
+            await asyncio.gather(reading, return_exceptions=True)
+            if not reading.cancelled():
+                connection.next_line = reading.result()
+            return True
+        waiter.cancel()
+        line = reading.result()
+        if line.strip() == b"noidle":
+            writer.write(b"OK\n")
+            return True
+        return False  # Disconnected, or a command MPD would reject mid-idle
+
+    async def handle(self, reader, writer):
+        """asyncio.start_server callback for one client connection."""
+        connection = _Connection(authorized=self.password is None)
+        self._connections.add(connection)
+        writer.write(f"OK MPD {PROTOCOL_VERSION}\n".encode())
+        command_list = None
+        try:
+            while True:
+                line, connection.next_line = connection.next_line, None
+                line = (line or await reader.readline()).decode().rstrip("\n")
+                if not line:
+                    break
+                if line in ("command_list_begin", "command_list_ok_begin"):
+                    command_list = (line == "command_list_ok_begin", [])
+                    continue
+                if command_list is not None and line != "command_list_end":
+                    command_list[1].append(line)
+                    continue
+
+                if line == "command_list_end":
+                    list_ok, lines = command_list
+                    command_list = None
+                elif line.startswith("idle"):
+                    if not await self._idle(connection, reader, writer):
+                        break
+                    continue
+                else:
+                    list_ok, lines = False, [line]
+
+                response = b""
+                try:
+                    for index, command in enumerate(lines):
+                        try:
+                            response += self._execute(connection, command)
+                        except _Ack as e:
+                            name = command.split(" ", 1)[0]
+                            raise _Ack(e.code, f"[{e.code}@{index}] {{{name}}} {e}")
+                        if list_ok:
+                            response += b"list_OK\n"
+                    writer.write(response + b"OK\n")
+                except _Ack as e:
+                    writer.write(response + f"ACK {e}\n".encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(connection)
+            writer.close()
+
+
+async def serve(args):
+    cover = None
+    if args.cover:
+        with open(args.cover, "rb") as f:
+            cover = f.read()
+    fake = FakeMPD(password=args.password, cover=cover, embedded=not args.albumart)
+    server = await asyncio.start_server(fake.handle, args.host, args.port)
+    print(f"Fake MPD on {args.host}:{args.port}")
+    async with server:
+        n = 0
+        while True:
+            album = f"Album {n // args.tracks_per_album}"
+            fake.play(f"Track {n}", album=album)
+            print(f"Playing Track {n} from {album}")
+            n += 1
+            await asyncio.sleep(args.interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6601)
+    parser.add_argument("--interval", type=float, default=5, help="seconds per track")
+    parser.add_argument("--tracks-per-album", type=int, default=3)
+    parser.add_argument("--cover", help="image file served as every track's cover")
+    parser.add_argument("--albumart", action="store_true",
+                        help="serve the cover as a folder file (albumart), not embedded (readpicture)")
+    parser.add_argument("--password")
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
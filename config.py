@@ -2,3 +2,51 @@ WEB_SERVER_HOST = "0.0.0.0"
 WEB_SERVER_PORT = 5556
 TCP_SERVER_PORT = 5557
 TARGET_RENDERER_NAME = "Apollo UPNP"
+# Players to run, each its own zone; a board names the zones it follows in its hello.
+# plugin: upnp (renderer_name), shairport (pipe_path) or mpd (host, port, password;
+# a host starting with "/" is MPD's unix socket). Only listed plugins are imported.
+PLAYERS = [
+    {"plugin": "upnp", "zone": "UPNP", "renderer_name": TARGET_RENDERER_NAME},
+    {"plugin": "shairport", "zone": "AirPlay", "pipe_path": "/tmp/shairport-sync-metadata"},
+    # Opt-in: uncomment on a box that runs MPD.
+    # {"plugin": "mpd", "zone": "MPD", "host": "localhost", "port": 6600},
+]
+# Zones for boards whose hello names none; None follows the zone that last
+# started playing, ["*"] every zone.
+TCP_DEFAULT_ZONES = None
+TCP_CLIENT_QUEUE_SIZE = 4  # unsent state frames kept per board before dropping the oldest
+TCP_CLIENT_WRITE_TIMEOUT = 5.0  # seconds a board may stall before it is disconnected
+TCP_HELLO_TIMEOUT = 0.25  # seconds to wait for a board's hello frame before assuming full-state mode
+SESSION_COALESCE_WINDOW_MS = 30  # updates within this window go out as a single broadcast
+SESSION_SNAPSHOT_PATH = "/tmp/apollo_state.json"  # last state of every zone, served to boards right after a restart
+SESSION_SNAPSHOT_INTERVAL = 2  # seconds between snapshot writes while the state is changing
+SESSION_SNAPSHOT_MAX_AGE = 60  # seconds after which restored playing zones come back paused
+ART_WORKERS = 2  # album art jobs downloading or rendering at once
+ART_HTTP_LIMIT_PER_HOST = 2  # pooled keep-alive connections per art host
+ART_HTTP_TIMEOUT = 10  # seconds for a whole art download
+ART_REVALIDATE_AFTER = 24 * 60 * 60  # seconds before cached remote art is revalidated with its ETag/Last-Modified
+ART_CACHE_DISK_BUDGET = 64 * 1024 * 1024  # bytes of processed art kept on disk
+ART_CACHE_MEMORY_BUDGET = 8 * 1024 * 1024  # bytes of processed art kept hot in memory
+# Extra pre-rendered art variants, requested as /art/<file>?format=<key>.
+# format: jpeg, rgb888, rgb565 (big-endian) or rgb565le; fit: stretch, cover or contain.
+# The 128x128 JPEG that cover_url points at is always rendered.
+ART_VARIANTS = {
+    "rgb565_64": {"format": "rgb565", "size": (64, 64)},
+    "rgb565_64x32": {"format": "rgb565", "size": (64, 32), "fit": "contain"},
+    "rgb888_128": {"format": "rgb888", "size": (128, 128)},
+}
+TCP_ART_CHUNK_SIZE = 4096  # bytes of art per binary frame when boards take art inline
+ART_RENDER_PROCESSES = 2  # worker processes decoding and resizing art, 0 renders on the art threads
+UPNP_RENDERER_CACHE = "/tmp/apollo_upnp_renderer.json"  # last known renderer location, tried before SSDP discovery
+UPNP_SUBSCRIPTION_TIMEOUT = 300  # seconds requested for renderer event subscriptions, renewed at half time
+UPNP_LIVENESS_TIMEOUT = 60  # seconds without events before the renderer is polled to check it is alive
+UPNP_PREFETCH_TRACKS = 2  # upcoming playlist tracks whose art is cached ahead of time, 0 disables
+LOG_LEVEL = "INFO"  # default level; DEBUG also logs every broadcast state and art step
+# Per-module overrides, keyed by module path (e.g. "state.session", "tcp_server").
+LOG_LEVELS = {
+    "aiohttp": "WARNING",
+    "async_upnp_client": "WARNING",
+}
+LOG_RATE_LIMIT = 5  # records per second allowed for any one message before sampling kicks in
+LOG_RATE_BURST = 20  # records of one message allowed in a burst
+LOG_SAMPLE_EVERY = 100  # once rate limited, one record in this many still gets through
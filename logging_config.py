@@ -0,0 +1,85 @@
+# logging_config.py
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+DEFAULT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+DEFAULT_RATE_LIMIT = 5  # records per second for one message
+DEFAULT_RATE_BURST = 20
+DEFAULT_SAMPLE_EVERY = 100  # past the limit, let one in this many through
+
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per message (logger and format string, not the arguments).
+
+    Once a message runs out of tokens, only every `sample_every`-th record of
+    it passes, and the next one that does reports how many were suppressed.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE_LIMIT, burst=DEFAULT_RATE_BURST,
+                 sample_every=DEFAULT_SAMPLE_EVERY):
+        super().__init__()
+        self._rate = rate
+        self._burst = burst
+        self._sample_every = sample_every
+        self._buckets = {}  # (logger name, msg) -> (tokens, last refill, suppressed)
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, suppressed = self._buckets.get(key, (self._burst, now, 0))
+            tokens = min(self._burst, tokens + (now - last) * self._rate)
+            if tokens >= 1:
+                tokens -= 1
+                passed = True
+            else:
+                suppressed += 1
+                passed = bool(self._sample_every) and suppressed % self._sample_every == 0
+            if passed and suppressed:
+                record.msg = f"{record.msg} (+{suppressed} similar suppressed)"
+                suppressed = 0
+            self._buckets[key] = (tokens, now, suppressed)
+        return passed
+
+
+def setup(level="INFO", levels=None, fmt=DEFAULT_FORMAT, rate=DEFAULT_RATE_LIMIT,
+          burst=DEFAULT_RATE_BURST, sample_every=DEFAULT_SAMPLE_EVERY):
+    """Routes all logging through a queue to a background writer thread.
+
+    Callers only pay for a level check, the rate limit and a queue put; the
+    formatting and the write to stderr/journald happen on the listener thread.
+    `levels` maps logger names (module paths) to their own levels.
+    """
+    global _listener
+    shutdown()
+
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(RateLimitFilter(rate, burst, sample_every))
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(fmt))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    for name, module_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = logging.handlers.QueueListener(records, stream_handler)
+    _listener.start()
+    atexit.register(shutdown)
+
+
+def shutdown():
+    """Writes out whatever is still queued and stops the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
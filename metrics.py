@@ -0,0 +1,173 @@
+# metrics.py
+import bisect
+import threading
+import time
+
+# Seconds; wide enough for a pipe read (sub-ms) and a slow cover download (s).
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (0, 1, 2, 4, 8, 16, 32)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        with _registry_lock:
+            _registry.append(self)
+        if not self._labelnames:
+            self.labels()  # Report unlabelled metrics from the start, as zero
+
+    def labels(self, *values):
+        """Returns the child for one combination of label values, creating it once."""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        return self.labels()
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            lines.extend(child.samples(self.name, self._labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def samples(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {self._value}"]
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. events handled or bytes written."""
+    kind = "counter"
+    _new_child = staticmethod(_CounterChild)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+    def set(self, value):
+        self._value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, e.g. connected boards."""
+    kind = "gauge"
+    _new_child = staticmethod(_GaugeChild)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set(self, value):
+        self._default().set(value)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def samples(self, name, labelnames, values):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        lines, cumulative = [], 0
+        for bound, count in zip((*self._buckets, "+Inf"), counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {total}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Counts observations into cumulative buckets, e.g. how long a stage took."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self._buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self._buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+class _Timer:
+    """Context manager observing the time spent in its block, in seconds."""
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._child.observe(time.perf_counter() - self._started)
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
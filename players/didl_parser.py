@@ -0,0 +1,44 @@
+# players/didl_parser.py
+from functools import lru_cache
+from lxml import etree
+
+CACHE_SIZE = 32
+
+_NS = {'dc': 'http://purl.org/dc/elements/1.1/', 'upnp': 'urn:schemas-upnp-org:metadata-1-0/upnp/'}
+
+# DIDL-Lite puts one <item> (or <container>) directly under the root, so
+# child paths are enough; the descendant forms only cover odd renderers.
+_FIELDS = {
+    "title": (etree.XPath("*/dc:title/text()", namespaces=_NS),
+              etree.XPath("//dc:title/text()", namespaces=_NS)),
+    "artist": (etree.XPath("*/upnp:artist/text()", namespaces=_NS),
+               etree.XPath("//upnp:artist/text()", namespaces=_NS)),
+    "cover_url": (etree.XPath("*/upnp:albumArtURI/text()", namespaces=_NS),
+                  etree.XPath("//upnp:albumArtURI/text()", namespaces=_NS)),
+    "songid": (etree.XPath("*/@id"),  # Use the item's 'id' attribute
+               etree.XPath("//@id")),
+}
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse_cached(track_metadata_xml):
+    root = etree.fromstring(track_metadata_xml)
+    parsed = []
+    for key, (direct, fallback) in _FIELDS.items():
+        found = direct(root) or fallback(root)
+        parsed.append((key, str(found[0]) if found else None))
+    return tuple(parsed)
+
+
+def parse_didl_metadata(track_metadata_xml):
+    """Extracts title, artist, cover_url and songid from a DIDL-Lite document.
+
+    OpenHome services resend identical Metadata strings all the time, so
+    results are memoized on the string and repeats skip parsing entirely.
+    """
+    if not track_metadata_xml:
+        return {}
+    if isinstance(track_metadata_xml, str):
+        # lxml refuses str input that carries an encoding declaration.
+        track_metadata_xml = track_metadata_xml.encode('utf-8')
+    return dict(_parse_cached(track_metadata_xml))
@@ -1,18 +1,24 @@
 # players/mock_player.py
+import logging
 import time
 import threading
 
+logger = logging.getLogger(__name__)
+
 class MockPlayer:
     """
     A mock player that simulates state changes internally and reports them
     via a callback, mimicking a real event-driven player.
     """
-    def __init__(self, on_state_change_callback):
+    def __init__(self, on_state_change_callback, interval=8, states=None, start_delay=1):
         self.name = "MOCK"
         self._on_state_change = on_state_change_callback
+        self._interval = interval
+        self._start_delay = start_delay
         self._state_index = 0
         self._lock = threading.Lock()
-        self._mock_states = [
+        self._stopped = threading.Event()
+        self._mock_states = states or [
             {
                 "player_state": "playing", "artist": "Daft Punk", "album": "Discovery",
                 "title": "One More Time", "songid": "101"
@@ -37,22 +43,30 @@ class MockPlayer:
     def _run_simulation(self):
         """Internal method to simulate state changes and fire the callback."""
         # Fire an initial event on startup
-        time.sleep(1)
+        if self._stopped.wait(self._start_delay):
+            return
         state = self.get_state()
         self._on_state_change(self.name, state)
 
+        next_change = time.monotonic()
         while True:
-            # Simulate a state change every 8 seconds
-            time.sleep(8)
-            
+            # Simulate a state change every `interval` seconds, without drifting
+            next_change += self._interval
+            if self._stopped.wait(max(0, next_change - time.monotonic())):
+                return
+
             with self._lock:
                 self._state_index = (self._state_index + 1) % len(self._mock_states)
-                print(f"MockPlayer: Internal state changed to index {self._state_index}")
+                logger.debug("Internal state changed to index %d", self._state_index)
             
             # Announce the new state via the callback
             state = self.get_state()
             self._on_state_change(self.name, state)
 
+    def stop(self):
+        """Stops the simulation thread."""
+        self._stopped.set()
+
     def get_state(self):
         """Returns the current mock state in a thread-safe way."""
         with self._lock:
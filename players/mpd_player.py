@@ -0,0 +1,208 @@
+# players/mpd_player.py
+import asyncio
+import logging
+import os
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 6600
+RECONNECT_DELAY = 5
+# Asked for with binarylimit (MPD 0.22.4+), so a cover usually arrives in one
+# or two round trips instead of MPD's default 8 KiB chunks.
+BINARY_LIMIT = 1024 * 1024
+MAX_COVER_BYTES = 16 * 1024 * 1024
+
+state_map = {"play": "playing", "pause": "paused", "stop": "stopped"}
+
+UPDATE_SECONDS = metrics.Histogram(
+    "apollo_mpd_update_seconds", "Time from an MPD idle wakeup to the update being queued.")
+COVER_SECONDS = metrics.Histogram(
+    "apollo_mpd_cover_seconds", "Time to read one cover over the MPD connection.")
+COVER_BYTES = metrics.Counter("apollo_mpd_cover_bytes_total", "Cover bytes read from MPD.")
+
+
+class MPDError(Exception):
+    """An ACK response from MPD."""
+
+
+def _quote(argument):
+    escaped = argument.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def _split_lists(pairs):
+    """Splits command_list_ok_begin results into one dict per command."""
+    results, current = [], {}
+    for key, value in pairs:
+        if key is None:
+            results.append(current)
+            current = {}
+        else:
+            current[key] = value
+    return results
+
+
+class MPDPlayer:
+    """An asyncio-native player that follows MPD over one persistent connection.
+
+    It waits in `idle player`, so MPD pushes every change and nothing is
+    polled. On each wakeup, status and currentsong are read in a single
+    command list. The cover is read over the same connection with
+    readpicture (embedded art), falling back to albumart (a cover file in
+    the song's folder). The cover is passed as cover_data, so it is never
+    fetched over HTTP.
+    """
+
+    def __init__(self, session_manager, host="localhost", port=DEFAULT_PORT,
+                 password=None, name="MPD"):
+        self.name = name  # also the zone this server reports to
+        self._host = host  # a path connects to MPD's unix socket
+        self._port = port
+        self._password = password
+        self._session_manager = session_manager
+        self._reader = None
+        self._writer = None
+        self._songid = None
+        self._cover_key = None  # (folder, album) the last cover was read for
+        self._cover_data = None
+
+    async def _connect(self):
+        if self._host.startswith("/"):
+            self._reader, self._writer = await asyncio.open_unix_connection(self._host)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(self._host, self._port)
+        greeting = await self._reader.readline()
+        if not greeting.startswith(b"OK MPD "):
+            raise ConnectionError(f"Not an MPD server: {greeting[:64]!r}")
+        logger.info("Connected to %s (protocol %s).", self._host, greeting[7:].decode().strip())
+        if self._password:
+            await self._command(f"password {_quote(self._password)}")
+        try:
+            await self._command(f"binarylimit {BINARY_LIMIT}")
+        except MPDError:
+            pass  # Older MPD, covers just take more round trips
+
+    async def _read_response(self):
+        """Reads one response: (key, value) pairs and the binary payload, if any.
+
+        A list_OK separator is returned as a (None, None) pair.
+        """
+        pairs, binary = [], None
+        while True:
+            line = await self._reader.readline()
+            if not line.endswith(b"\n"):
+                raise ConnectionError("MPD closed the connection")
+            line = line[:-1]
+            if line == b"OK":
+                return pairs, binary
+            if line.startswith(b"ACK "):
+                raise MPDError(line[4:].decode("utf-8", "replace"))
+            if line == b"list_OK":
+                pairs.append((None, None))
+                continue
+            key, _, value = line.decode("utf-8", "replace").partition(": ")
+            if key == "binary":
+                binary = await self._reader.readexactly(int(value) + 1)
+                binary = binary[:-1]  # Drop the newline after the payload
+            else:
+                pairs.append((key, value))
+
+    async def _command(self, *commands):
+        """Sends one command, or several as a command list, and returns the response."""
+        if len(commands) > 1:
+            commands = ("command_list_ok_begin", *commands, "command_list_end")
+        self._writer.write("".join(f"{command}\n" for command in commands).encode())
+        return await self._read_response()
+
+    async def _read_binary(self, command, uri):
+        """Reads a whole readpicture/albumart payload, chunk by chunk. None if there is none."""
+        chunks, offset, size = [], 0, None
+        while size is None or offset < size:
+            pairs, binary = await self._command(f"{command} {_quote(uri)} {offset}")
+            fields = dict(pairs)
+            if not binary or "size" not in fields:
+                break  # No picture; readpicture just answers OK
+            size = int(fields["size"])
+            if size > MAX_COVER_BYTES:
+                logger.warning("Skipping a %d byte cover for %s.", size, uri)
+                return None
+            chunks.append(binary)
+            offset += len(binary)
+        return b"".join(chunks) or None
+
+    async def _read_cover(self, song):
+        uri = song.get("file")
+        if not uri or "://" in uri:
+            return None  # Streams have no art of their own
+        # Tracks of one album nearly always share a cover; don't re-read it.
+        key = (os.path.dirname(uri), song.get("Album"))
+        if key == self._cover_key:
+            return self._cover_data
+
+        started = time.perf_counter()
+        data = None
+        for command in ("readpicture", "albumart"):
+            try:
+                data = await self._read_binary(command, uri)
+            except MPDError as e:
+                logger.debug("%s failed for %s: %s", command, uri, e)
+            if data:
+                break
+        COVER_SECONDS.observe(time.perf_counter() - started)
+        if data:
+            COVER_BYTES.inc(len(data))
+        self._cover_key, self._cover_data = key, data
+        return data
+
+    async def _sync(self):
+        """Reads status and the current song and reports whatever changed."""
+        started = time.perf_counter()
+        pairs, _ = await self._command("status", "currentsong")
+        status, song = _split_lists(pairs)
+        player_state = state_map.get(status.get("state"), "stopped")
+
+        if player_state == "stopped" or not song:
+            self._songid = None
+            self._session_manager.update_transport_state(self.name, "stopped")
+            UPDATE_SECONDS.observe(time.perf_counter() - started)
+            return
+
+        title = song.get("Title") or song.get("Name") or os.path.basename(song.get("file", ""))
+        # Radio streams change Title without changing Id.
+        songid = f"mpd-{song.get('Id')}-{title}"
+        if songid != self._songid:
+            self._songid = songid
+            cover_data = await self._read_cover(song)
+            standardized_state = {
+                "songid": songid,
+                "title": title,
+                "artist": song.get("Artist"),
+                "album": song.get("Album"),
+                "cover_url": None,
+            }
+            self._session_manager.update_metadata(self.name, standardized_state, cover_data=cover_data)
+        # After the metadata, which always marks the zone as playing.
+        self._session_manager.update_transport_state(self.name, player_state)
+        UPDATE_SECONDS.observe(time.perf_counter() - started)
+
+    async def start(self):
+        """Main asyncio task: connect, report the current state, then idle for changes."""
+        while True:
+            try:
+                logger.info("Connecting to MPD at %s...", self._host)
+                await self._connect()
+                await self._sync()
+                while True:
+                    await self._command("idle player")
+                    await self._sync()
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, MPDError, ValueError) as e:
+                logger.error("Connection error: %s", e)
+            finally:
+                if self._writer is not None:
+                    self._writer.close()
+                    self._writer = None
+                self._songid = None
+                logger.info("Disconnected. Retrying in %ss.", RECONNECT_DELAY)
+            await asyncio.sleep(RECONNECT_DELAY)
@@ -0,0 +1,58 @@
+# players/plugins.py
+import asyncio
+import importlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# plugin name -> (module, class). Modules are imported only when a configured
+# player uses them, so e.g. lxml and async_upnp_client stay unloaded on a box
+# that only runs Shairport.
+PLUGINS = {
+    "upnp": ("players.upnp_player", "UPnPPlayer"),
+    "shairport": ("players.shairport_player", "ShairportPlayer"),
+    "mpd": ("players.mpd_player", "MPDPlayer"),
+}
+
+
+def player_class(plugin):
+    """Imports and returns the player class registered as `plugin`."""
+    if plugin not in PLUGINS:
+        raise ValueError(f"Unknown player plugin '{plugin}', expected one of {sorted(PLUGINS)}")
+    module_name, class_name = PLUGINS[plugin]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def validate_players(entries):
+    """Raises ValueError for a PLAYERS entry that can't be loaded, before anything starts."""
+    zones = set()
+    for entry in entries:
+        if entry.get("plugin") not in PLUGINS:
+            raise ValueError(f"Player {entry}: unknown plugin, expected one of {sorted(PLUGINS)}")
+        if not entry.get("zone"):
+            raise ValueError(f"Player {entry}: missing zone")
+        if entry["zone"] in zones:
+            raise ValueError(f"Player {entry}: zone '{entry['zone']}' is used twice")
+        zones.add(entry["zone"])
+
+
+async def load_players(entries, session_manager, defaults=None):
+    """Builds one player per PLAYERS entry, importing plugins off the event loop.
+
+    Each entry names its `plugin` and `zone`; any other keys are passed to the
+    player's constructor, on top of `defaults[plugin]`. Imports run in a
+    thread so the loop keeps serving boards while heavy libraries load.
+    """
+    loop = asyncio.get_running_loop()
+    players = []
+    for entry in entries:
+        options = dict(entry)
+        plugin = options.pop("plugin")
+        zone = options.pop("zone")
+        started = time.perf_counter()
+        cls = await loop.run_in_executor(None, player_class, plugin)
+        logger.debug("Loaded plugin '%s' in %.0f ms.", plugin, (time.perf_counter() - started) * 1000)
+        kwargs = {**(defaults or {}).get(plugin, {}), **options}
+        players.append(cls(session_manager=session_manager, name=zone, **kwargs))
+    return players
@@ -0,0 +1,146 @@
+# players/shairport_parser.py
+import binascii
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+ITEM_START = b"<item>"
+ITEM_END = b"</item>"
+DATA_START = b"<data"
+DATA_END = b"</data>"
+WHITESPACE = b" \t\r\n"
+
+_CODE_RE = re.compile(rb"<code>\s*([0-9a-fA-F]+)\s*</code>")
+_ENCODING_RE = re.compile(rb'encoding\s*=\s*"([^"]*)"')
+
+# Parser states
+_SEEK_ITEM = 0  # looking for <item>
+_HEADER = 1  # inside <item>, before <data ...> or </item>
+_DATA = 2  # streaming the <data> payload
+_TAIL = 3  # after </data>, looking for </item>
+
+
+class ShairportParser:
+    """Incremental, bytes-based parser for the shairport-sync metadata pipe.
+
+    feed() takes raw pipe chunks and returns the (code, value) items they
+    complete. Consumed bytes are dropped from the front of the buffer as soon
+    as they are parsed, and base64 payloads are decoded as they arrive, so
+    a multi-hundred-KB PICT costs time linear in its size however it is split.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._buffer = bytearray()
+        self._state = _SEEK_ITEM
+        self._scan_from = 0
+        self._code = ''
+        self._base64 = False
+        self._pending = bytearray()  # base64 characters not yet forming a full quantum
+        self._value = bytearray()
+        self._corrupt = False
+
+    def _start_item(self, header):
+        match = _CODE_RE.search(header)
+        code_hex = match.group(1) if match else b''
+        try:
+            self._code = bytes.fromhex(code_hex.decode()).decode('utf-8', 'ignore')
+        except ValueError:
+            self._code = ''
+        self._value = bytearray()
+        self._pending = bytearray()
+        self._corrupt = False
+
+    def _consume_data(self, raw):
+        if not self._base64:
+            self._value += raw
+            return
+        self._pending += raw.translate(None, WHITESPACE)
+        usable = len(self._pending) - len(self._pending) % 4
+        if usable and not self._corrupt:
+            try:
+                self._value += binascii.a2b_base64(self._pending[:usable])
+            except binascii.Error:
+                self._corrupt = True
+        del self._pending[:usable]
+
+    def _finish_value(self):
+        if self._base64:
+            if self._pending and not self._corrupt:
+                try:
+                    self._value += binascii.a2b_base64(self._pending)
+                except binascii.Error:
+                    self._corrupt = True
+            return bytes(self._value) or None
+        text = self._value.decode('utf-8', 'ignore').strip()
+        return text or None
+
+    def feed(self, chunk):
+        """Adds a chunk from the pipe and returns the list of items it completed."""
+        buffer = self._buffer
+        buffer += chunk
+        items = []
+
+        while True:
+            if self._state == _SEEK_ITEM:
+                start = buffer.find(ITEM_START)
+                if start == -1:
+                    # Keep only what could be the beginning of a split tag.
+                    del buffer[:max(0, len(buffer) - len(ITEM_START) + 1)]
+                    break
+                del buffer[:start + len(ITEM_START)]
+                self._state = _HEADER
+                self._scan_from = 0
+
+            elif self._state == _HEADER:
+                data_at = buffer.find(DATA_START, self._scan_from)
+                end_at = buffer.find(ITEM_END, self._scan_from)
+                if data_at != -1 and (end_at == -1 or data_at < end_at):
+                    tag_end = buffer.find(b">", data_at)
+                    if tag_end == -1:
+                        self._scan_from = data_at
+                        break
+                    self._start_item(bytes(buffer[:data_at]))
+                    encoding = _ENCODING_RE.search(buffer, data_at, tag_end)
+                    self._base64 = bool(encoding) and encoding.group(1) == b"base64"
+                    del buffer[:tag_end + 1]
+                    self._state = _DATA
+                elif end_at != -1:
+                    self._start_item(bytes(buffer[:end_at]))
+                    del buffer[:end_at + len(ITEM_END)]
+                    items.append((self._code, None))
+                    self._state = _SEEK_ITEM
+                else:
+                    self._scan_from = max(0, len(buffer) - len(ITEM_END) + 1)
+                    break
+
+            elif self._state == _DATA:
+                end_at = buffer.find(DATA_END)
+                if end_at == -1:
+                    # Decode everything except a possibly split </data> tag.
+                    safe = len(buffer) - len(DATA_END) + 1
+                    if safe > 0:
+                        self._consume_data(buffer[:safe])
+                        del buffer[:safe]
+                    break
+                self._consume_data(buffer[:end_at])
+                del buffer[:end_at + len(DATA_END)]
+                self._state = _TAIL
+
+            else:  # _TAIL
+                end_at = buffer.find(ITEM_END)
+                if end_at == -1:
+                    del buffer[:max(0, len(buffer) - len(ITEM_END) + 1)]
+                    break
+                del buffer[:end_at + len(ITEM_END)]
+                value = self._finish_value()
+                if self._corrupt:
+                    logger.warning("Dropping item '%s' with corrupt base64 data.", self._code)
+                else:
+                    items.append((self._code, value))
+                self._state = _SEEK_ITEM
+
+        return items
@@ -1,38 +1,75 @@
 # players/upnp_player.py
 import asyncio
+import base64
+import json
+import logging
+import os
+import struct
+import time
 from lxml import etree
+import metrics
 from async_upnp_client.aiohttp import AiohttpRequester, AiohttpNotifyServer
 from async_upnp_client.client_factory import UpnpFactory
-from async_upnp_client.search import async_search
+from async_upnp_client.search import SsdpSearchListener
 from async_upnp_client.utils import get_local_ip
+from players.didl_parser import parse_didl_metadata
+from players.upnp_subscriptions import (
+    DEFAULT_LIVENESS_TIMEOUT, DEFAULT_SUBSCRIPTION_TIMEOUT, UPnPSubscriptions)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RENDERER_CACHE = "/tmp/apollo_upnp_renderer.json"
+SEARCH_TIMEOUT = 5
+CACHED_DEVICE_TIMEOUT = 3
+RETRY_DELAY = 1
+DEFAULT_PREFETCH_TRACKS = 2
+PLAYLIST_TRACK_VARS = ("Id", "IdArray")
+
+EVENT_SECONDS = metrics.Histogram(
+    "apollo_upnp_event_seconds", "Time to handle one renderer event, metadata parsing included.")
+EVENTS = metrics.Counter("apollo_upnp_events_total", "Renderer events received.")
+
+
+def _decode_id_array(id_array):
+    """OpenHome IdArray: base64 of big-endian uint32 track ids in playlist order."""
+    if isinstance(id_array, str):
+        id_array = base64.b64decode(id_array)
+    return list(struct.unpack(f">{len(id_array) // 4}I", id_array[:len(id_array) // 4 * 4]))
+
+
+def _track_list_metadata(track_list_xml):
+    """Returns {track id: DIDL-Lite metadata} from a Playlist ReadList response."""
+    root = etree.fromstring(track_list_xml.encode('utf-8'))
+    return {int(entry.findtext("{*}Id")): entry.findtext("{*}Metadata")
+            for entry in root.iter("{*}Entry")}
+
 
 class UPnPPlayer:
-    def __init__(self, renderer_name, session_manager):
-        self.name = "UPNP"
+    def __init__(self, renderer_name, session_manager, renderer_cache_path=DEFAULT_RENDERER_CACHE,
+                 subscription_timeout=DEFAULT_SUBSCRIPTION_TIMEOUT,
+                 liveness_timeout=DEFAULT_LIVENESS_TIMEOUT,
+                 prefetch_tracks=DEFAULT_PREFETCH_TRACKS, name="UPNP"):
+        self.name = name  # also the zone this renderer reports to
         self._renderer_name = renderer_name
+        self._renderer_cache_path = renderer_cache_path
+        self._subscription_timeout = subscription_timeout
+        self._liveness_timeout = liveness_timeout
+        self._prefetch_tracks = prefetch_tracks
+        self._subscriptions = None
+        self._playlist_service = None
+        self._prefetch_task = None
         self.state = {"player_state": "stopped", "title": None, "artist": None, "cover_url": None}
         self.lock = asyncio.Lock()
         self._session_manager = session_manager
 
     def _parse_metadata(self, track_metadata_xml):
-        if not track_metadata_xml: return {}
-        
-        root = etree.fromstring(track_metadata_xml)
-        ns = {'dc': 'http://purl.org/dc/elements/1.1/', 'upnp': 'urn:schemas-upnp-org:metadata-1-0/upnp/'}
-        
-        title = root.xpath("//dc:title/text()", namespaces=ns)
-        artist = root.xpath("//upnp:artist/text()", namespaces=ns)
-        cover_art = root.xpath("//upnp:albumArtURI/text()", namespaces=ns)
-        songid = root.xpath("//@id", namespaces=ns) # Use the item's 'id' attribute
-
-        return {
-            "title": title[0] if title else None,
-            "artist": artist[0] if artist else None,
-            "cover_url": cover_art[0] if cover_art else None,
-            "songid": songid[0] if songid else None
-        }
+        return parse_didl_metadata(track_metadata_xml)
 
     def _event_callback(self, service, state_vars):
+        started = time.perf_counter()
+        EVENTS.inc()
+        if self._subscriptions:
+            self._subscriptions.mark_alive()
         try:
             transport_state = next((var.value for var in state_vars if var.name == 'TransportState'), None)
             if transport_state:
@@ -40,46 +77,166 @@ class UPnPPlayer:
 
             metadata_xml = next((var.value for var in state_vars if var.name == 'Metadata'), None)
             if metadata_xml:
-                print(metadata_xml)
                 new_metadata = self._parse_metadata(metadata_xml)
                 self._session_manager.update_metadata(self.name, new_metadata)
 
+            if service is self._playlist_service and any(
+                    var.name in PLAYLIST_TRACK_VARS for var in state_vars):
+                self._schedule_prefetch()
+
+        except Exception as e:
+            logger.error("Error processing UPnP event: %s", e)
+        EVENT_SECONDS.observe(time.perf_counter() - started)
+
+    def _schedule_prefetch(self):
+        if self._prefetch_tracks <= 0 or self._playlist_service is None:
+            return
+        # Skips arrive in bursts; only the newest playlist position matters.
+        if self._prefetch_task:
+            self._prefetch_task.cancel()
+        self._prefetch_task = asyncio.get_running_loop().create_task(
+            self._prefetch_upcoming(self._playlist_service))
+
+    async def _prefetch_upcoming(self, playlist_service):
+        """Hands the covers of the next tracks in the playlist to the art pipeline."""
+        try:
+            if not all(playlist_service.has_action(name) for name in ("Id", "IdArray", "ReadList")):
+                return
+            current = await playlist_service.action("Id").async_call()
+            id_array = await playlist_service.action("IdArray").async_call()
+            track_ids = _decode_id_array(id_array["Array"])
+            current_id = current.get("Value")
+            start = track_ids.index(current_id) + 1 if current_id in track_ids else 0
+            upcoming = track_ids[start:start + self._prefetch_tracks]
+            if not upcoming:
+                return
+
+            result = await playlist_service.action("ReadList").async_call(
+                IdList=" ".join(str(track_id) for track_id in upcoming))
+            metadata = _track_list_metadata(result["TrackList"])
+            cover_urls = [parse_didl_metadata(metadata.get(track_id)).get("cover_url")
+                          for track_id in upcoming]
+            self._session_manager.prefetch_art(self.name, [url for url in cover_urls if url])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Failed to read upcoming tracks for prefetch: %s", e)
+
+    def _read_renderer_cache(self):
+        """All cached renderers, keyed by lowercased friendly name."""
+        try:
+            with open(self._renderer_cache_path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(cached, dict):
+            return {}
+        if "name" in cached:
+            # Written when only one renderer was supported.
+            return {cached["name"].lower(): cached}
+        return cached
+
+    def _load_renderer_cache(self):
+        return self._read_renderer_cache().get(self._renderer_name.lower())
+
+    def _save_renderer_cache(self, device):
+        # Several zones share the file; the players run on one loop, so the
+        # read-modify-write below never interleaves.
+        renderers = self._read_renderer_cache()
+        renderers[self._renderer_name.lower()] = {
+            "name": self._renderer_name, "location": device.device_url, "udn": device.udn}
+        try:
+            tmp_path = f"{self._renderer_cache_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(renderers, f)
+            os.replace(tmp_path, self._renderer_cache_path)
+        except OSError as e:
+            logger.warning("Failed to save renderer cache: %s", e)
+
+    async def _connect_cached(self, factory):
+        """Tries the last known renderer location directly, skipping discovery."""
+        cached = self._load_renderer_cache()
+        if not cached:
+            return None
+        try:
+            device = await asyncio.wait_for(
+                factory.async_create_device(cached["location"]), CACHED_DEVICE_TIMEOUT)
         except Exception as e:
-            print(f"Error processing UPnP event: {e}")
+            logger.info("Cached renderer at %s unreachable: %s", cached['location'], e)
+            return None
+        # The address may have been handed to another device since.
+        if device.udn != cached.get("udn"):
+            logger.info("Cached location now belongs to a different device.")
+            return None
+        logger.info("Reconnected to cached renderer")
+        return device
+
+    async def _discover(self, factory):
+        """Runs an SSDP search, returning as soon as the target renderer is found."""
+        loop = asyncio.get_running_loop()
+        found = loop.create_future()
+        seen_locations = set()
+
+        async def on_response(headers):
+            location = headers.get("location")
+            # Devices answer once per service; describe each location only once.
+            if not location or location in seen_locations or found.done():
+                return
+            seen_locations.add(location)
+            try:
+                device = await factory.async_create_device(location)
+            except Exception as e:
+                logger.debug("Cannot create device at %s: %s", location, e)
+                return
+            if self._renderer_name.lower() == device.friendly_name.lower() and not found.done():
+                logger.info("Target renderer found")
+                found.set_result(device)
+
+        listener = SsdpSearchListener(async_callback=on_response, loop=loop, timeout=SEARCH_TIMEOUT)
+        await listener.async_start()
+        try:
+            listener.async_search()
+            return await asyncio.wait_for(found, SEARCH_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            listener.async_stop()
+
+    async def _find_renderer(self, factory):
+        device = await self._connect_cached(factory)
+        if device is None:
+            logger.info("Searching for devices...")
+            device = await self._discover(factory)
+        if device is not None:
+            self._save_renderer_cache(device)
+        return device
+
+    async def _poll_current_state(self, info_service, playlist_service):
+        """Reads transport state and track metadata directly, without waiting for events."""
+        if playlist_service.has_action("TransportState"):
+            result = await playlist_service.action("TransportState").async_call()
+            if result.get("Value"):
+                self._session_manager.update_transport_state(self.name, result["Value"])
+        if info_service.has_action("Track"):
+            result = await info_service.action("Track").async_call()
+            if result.get("Metadata"):
+                self._session_manager.update_metadata(
+                    self.name, self._parse_metadata(result["Metadata"]))
 
     async def start(self):
         requester = AiohttpRequester(timeout=10)
         factory = UpnpFactory(requester, non_strict=True)
         info_service_id = 'urn:av-openhome-org:service:Info:1'
         playlist_service_id = 'urn:av-openhome-org:service:Playlist:1'
-        target_device = None
 
         while True:
+            server = None
+            self._subscriptions = None
             try:
-                print("UPnP: Searching for devices...")
-
-                async def on_device_found(headers):
-                    nonlocal target_device
-                    if target_device:
-                        return
-                    # maybe optimize to find target device and do early return
-                    location = headers.get("location")
-                    if not location:
-                        return
-
-                    try:
-                        device = await factory.async_create_device(location)
-                        if self._renderer_name.lower() == device.friendly_name.lower():
-                            print("UPnP: Target renderer found")
-                            target_device = device
-                    except Exception as e:
-                        print(f"cannot create device at {location} : {e} ")
-                        return
-
-                await async_search(async_callback=on_device_found, timeout=5)
+                target_device = await self._find_renderer(factory)
 
                 if not target_device:
-                    print("UPnP: Target renderer not found in search results. Retrying in 15s.")
+                    logger.warning("Target renderer not found in search results. Retrying in 15s.")
                     await asyncio.sleep(15)
                     continue
 
@@ -91,16 +248,32 @@ class UPnPPlayer:
                 info_service.on_event = self._event_callback
                 playlist_service = target_device.service(playlist_service_id)
                 playlist_service.on_event = self._event_callback
+                self._playlist_service = playlist_service
 
-                event_handler = server.event_handler
-                await asyncio.gather(
-                    event_handler.async_subscribe(info_service),
-                    event_handler.async_subscribe(playlist_service)
-                )
+                self._subscriptions = UPnPSubscriptions(
+                    server.event_handler, [info_service, playlist_service],
+                    timeout=self._subscription_timeout,
+                    liveness_timeout=self._liveness_timeout)
+                await self._subscriptions.subscribe()
+                logger.info("Subscribed to renderer events")
 
-                while True:
-                    await asyncio.sleep(60)
+                # Boards should be right immediately, not after the next event.
+                await self._poll_current_state(info_service, playlist_service)
+                self._schedule_prefetch()
+                await self._subscriptions.maintain(
+                    probe=lambda: self._poll_current_state(info_service, playlist_service))
 
             except Exception as e:
-                print(f"UPnP Error/Retry: {e}")
-                await asyncio.sleep(5)
+                logger.warning("Error/Retry: %s", e)
+            finally:
+                self._playlist_service = None
+                if self._prefetch_task:
+                    self._prefetch_task.cancel()
+                    self._prefetch_task = None
+                if self._subscriptions:
+                    await self._subscriptions.close()
+                    self._subscriptions = None
+                if server:
+                    await server.async_stop_server()
+            # The next attempt tries the cached location first, so retry soon.
+            await asyncio.sleep(RETRY_DELAY)
@@ -0,0 +1,74 @@
+# players/upnp_subscriptions.py
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SUBSCRIPTION_TIMEOUT = 300
+DEFAULT_LIVENESS_TIMEOUT = 60
+RENEW_FRACTION = 0.5  # renew once half of the granted timeout has passed
+CHECK_INTERVAL = 5
+
+
+class UPnPSubscriptions:
+    """Keeps GENA event subscriptions for a set of services alive.
+
+    Subscriptions are renewed well before they expire. A rejected renewal
+    (the renderer forgot our SID) is answered with a fresh subscription on the
+    same device rather than a rediscovery. If no event arrives for a while,
+    `probe` is called to prove the renderer is still there. maintain() only
+    raises once the renderer is really unreachable.
+    """
+
+    def __init__(self, event_handler, services, timeout=DEFAULT_SUBSCRIPTION_TIMEOUT,
+                 liveness_timeout=DEFAULT_LIVENESS_TIMEOUT):
+        self._event_handler = event_handler
+        self._services = services
+        self._timeout = timedelta(seconds=timeout)
+        self._liveness_timeout = liveness_timeout
+        self._renew_at = 0
+        self._last_alive = time.monotonic()
+
+    def mark_alive(self):
+        """Called for every event received from the renderer."""
+        self._last_alive = time.monotonic()
+
+    def _schedule_renewal(self, granted_timeouts):
+        shortest = min(granted.total_seconds() for granted in granted_timeouts)
+        self._renew_at = time.monotonic() + shortest * RENEW_FRACTION
+
+    async def subscribe(self):
+        results = await asyncio.gather(*(
+            self._event_handler.async_subscribe(service, timeout=self._timeout)
+            for service in self._services))
+        self._schedule_renewal(granted for _, granted in results)
+        self.mark_alive()
+
+    async def _renew_one(self, service):
+        try:
+            _, granted = await self._event_handler.async_resubscribe(service, timeout=self._timeout)
+        except Exception as e:
+            logger.info("Renewal for %s rejected (%s), subscribing again.", service.service_id, e)
+            _, granted = await self._event_handler.async_subscribe(service, timeout=self._timeout)
+        return granted
+
+    async def maintain(self, probe):
+        """Renews and checks the subscriptions until the renderer is lost (raises)."""
+        while True:
+            await asyncio.sleep(CHECK_INTERVAL)
+            now = time.monotonic()
+            if now >= self._renew_at:
+                granted = await asyncio.gather(*(self._renew_one(service) for service in self._services))
+                self._schedule_renewal(granted)
+                self.mark_alive()
+            elif now - self._last_alive > self._liveness_timeout:
+                await probe()
+                self.mark_alive()
+
+    async def close(self):
+        try:
+            await self._event_handler.async_unsubscribe_all()
+        except Exception as e:
+            logger.warning("Failed to unsubscribe cleanly: %s", e)
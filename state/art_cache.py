@@ -0,0 +1,217 @@
+# state/art_cache.py
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "index.json"
+DEFAULT_DISK_BUDGET = 64 * 1024 * 1024
+DEFAULT_MEMORY_BUDGET = 8 * 1024 * 1024
+
+
+def _cover_key(filename):
+    """Variants of one cover share their name up to the extension (see variant_filename)."""
+    return filename.rsplit(".", 1)[0]
+
+
+def content_etag(data):
+    """Strong validator for a cached file, derived from its bytes."""
+    return hashlib.md5(data).hexdigest()
+
+
+class ArtCache:
+    """Two-tier LRU cache of processed art: hot bytes in memory, the rest on disk.
+
+    The on-disk index is loaded once at startup, so membership checks and LRU
+    bookkeeping never touch the filesystem. Both tiers evict least recently
+    used entries once they go over their byte budget. On disk, every variant
+    of a cover is used and evicted together, so a cover is either cached in
+    every format or not at all.
+    """
+
+    def __init__(self, cache_dir, disk_budget=DEFAULT_DISK_BUDGET,
+                 memory_budget=DEFAULT_MEMORY_BUDGET):
+        self._cache_dir = cache_dir
+        self._index_path = os.path.join(cache_dir, INDEX_FILENAME)
+        self._disk_budget = disk_budget
+        self._memory_budget = memory_budget
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # filename -> (size on disk, etag), least recent first
+        self._disk_bytes = 0
+        self._covers = {}  # cover key -> filenames of its variants in the index
+        self._memory = OrderedDict()  # filename -> bytes, least recent first
+        self._memory_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self._index_path) as f:
+                entries = [(name, size, etag) for name, size, etag in json.load(f)]
+        except FileNotFoundError:
+            entries = self._scan_dir()
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning("Index unreadable (%s), rebuilding from disk.", e)
+            entries = self._scan_dir()
+
+        for filename, size, etag in entries:
+            self._add(filename, size, etag)
+        logger.info("Loaded %d entries (%d bytes).", len(self._index), self._disk_bytes)
+        with self._lock:
+            self._evict_disk()
+            self._save_index()
+
+    def _scan_dir(self):
+        """Rebuilds index entries from the directory, oldest access first."""
+        entries = []
+        for entry in os.scandir(self._cache_dir):
+            if not entry.is_file() or entry.name.endswith((".json", ".tmp")):
+                continue
+            with open(entry.path, "rb") as f:
+                etag = content_etag(f.read())
+            stat = entry.stat()
+            entries.append((stat.st_atime, entry.name, stat.st_size, etag))
+        entries.sort()
+        return [(name, size, etag) for _, name, size, etag in entries]
+
+    def _save_index(self):
+        tmp_path = f"{self._index_path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump([(name, size, etag) for name, (size, etag) in self._index.items()], f)
+            os.replace(tmp_path, self._index_path)
+        except OSError as e:
+            logger.warning("Failed to save index: %s", e)
+
+    def _remember(self, filename, data):
+        if len(data) > self._memory_budget:
+            return
+        old = self._memory.pop(filename, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[filename] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self._memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _add(self, filename, size, etag):
+        self._index[filename] = (size, etag)
+        self._disk_bytes += size
+        self._covers.setdefault(_cover_key(filename), set()).add(filename)
+
+    def _touch(self, filename):
+        """Marks a file and the other variants of its cover as just used."""
+        for variant in self._covers[_cover_key(filename)]:
+            self._index.move_to_end(variant)
+
+    def _forget(self, filename):
+        entry = self._index.pop(filename, None)
+        if entry is not None:
+            self._disk_bytes -= entry[0]
+            variants = self._covers[_cover_key(filename)]
+            variants.discard(filename)
+            if not variants:
+                del self._covers[_cover_key(filename)]
+        data = self._memory.pop(filename, None)
+        if data is not None:
+            self._memory_bytes -= len(data)
+
+    def _evict_disk(self):
+        while self._disk_bytes > self._disk_budget and self._index:
+            oldest = next(iter(self._index))
+            for filename in list(self._covers[_cover_key(oldest)]):
+                self._forget(filename)
+                try:
+                    os.remove(os.path.join(self._cache_dir, filename))
+                except FileNotFoundError:
+                    pass
+
+    def contains(self, filename):
+        """Index-only lookup, never hits the filesystem."""
+        with self._lock:
+            return filename in self._index
+
+    def peek(self, filename):
+        """Returns (etag, bytes) without touching the filesystem, or None on a miss.
+
+        bytes is None when the entry only lives on disk; use get() to load it.
+        """
+        with self._lock:
+            entry = self._index.get(filename)
+            if entry is None:
+                return None
+            self._touch(filename)
+            data = self._memory.get(filename)
+            if data is not None:
+                self._memory.move_to_end(filename)
+            return entry[1], data
+
+    def get(self, filename):
+        """Returns cached bytes, promoting the entry, or None on a miss."""
+        with self._lock:
+            if filename not in self._index:
+                return None
+            self._touch(filename)
+            data = self._memory.get(filename)
+            if data is not None:
+                self._memory.move_to_end(filename)
+                return data
+
+        try:
+            with open(os.path.join(self._cache_dir, filename), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            # Removed behind our back, drop it so the art gets rebuilt.
+            with self._lock:
+                self._forget(filename)
+                self._save_index()
+            return None
+
+        with self._lock:
+            if filename in self._index:
+                self._remember(filename, data)
+        return data
+
+    def put(self, filename, data):
+        """Stores processed art in both tiers, evicting old entries as needed."""
+        self.put_many([(filename, data)])
+
+    def put_many(self, items):
+        """Stores several (filename, bytes) files with a single index update and write.
+
+        The files only become visible once all of them are on disk, so e.g.
+        every variant of a cover is added at once.
+        """
+        for filename, data in items:
+            path = os.path.join(self._cache_dir, filename)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            for filename, data in items:
+                self._forget(filename)
+                self._add(filename, len(data), content_etag(data))
+                self._remember(filename, data)
+            self._evict_disk()
+            self._save_index()
+
+    def save(self):
+        """Persists the current LRU order, e.g. on shutdown."""
+        with self._lock:
+            self._save_index()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "disk_bytes": self._disk_bytes,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+            }
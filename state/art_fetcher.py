@@ -0,0 +1,157 @@
+# state/art_fetcher.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT_PER_HOST = 2
+DEFAULT_TIMEOUT = 10
+DEFAULT_REVALIDATE_AFTER = 24 * 60 * 60
+DEFAULT_MAX_VALIDATORS = 2048  # URLs remembered, least recently fetched dropped first
+SAVE_DELAY = 5  # seconds of quiet before changed validators are written out
+
+
+class ArtFetcher:
+    """Downloads remote album art over one pooled keep-alive HTTP client.
+
+    Validators (ETag / Last-Modified) are remembered per URL so cached art can
+    be revalidated with a conditional request instead of a full download.
+    Only the `max_validators` most recently fetched URLs are kept, and changes
+    are written to disk in one batch, off the event loop, SAVE_DELAY seconds
+    after the first of them.
+    """
+
+    def __init__(self, validators_path, limit_per_host=DEFAULT_LIMIT_PER_HOST,
+                 timeout=DEFAULT_TIMEOUT, revalidate_after=DEFAULT_REVALIDATE_AFTER,
+                 max_validators=DEFAULT_MAX_VALIDATORS):
+        self._validators_path = validators_path
+        self._limit_per_host = limit_per_host
+        self._timeout = timeout
+        self._revalidate_after = revalidate_after
+        self._max_validators = max_validators
+        self._session = None
+        self._save_handle = None
+        self._write_lock = threading.Lock()
+        self._validators = self._load_validators()  # url -> entry, least recent first
+        self._trim_validators()
+
+    def _load_validators(self):
+        try:
+            with open(self._validators_path) as f:
+                return OrderedDict(json.load(f))
+        except FileNotFoundError:
+            return OrderedDict()
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning("Ignoring unreadable validators file: %s", e)
+            return OrderedDict()
+
+    def _trim_validators(self):
+        while len(self._validators) > self._max_validators:
+            self._validators.popitem(last=False)
+
+    def _write_validators(self, validators):
+        with self._write_lock:
+            try:
+                os.makedirs(os.path.dirname(self._validators_path), exist_ok=True)
+                tmp_path = f"{self._validators_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(validators, f)
+                os.replace(tmp_path, self._validators_path)
+            except OSError as e:
+                logger.warning("Failed to save validators: %s", e)
+
+    def _copy_validators(self):
+        return {url: dict(entry) for url, entry in self._validators.items()}
+
+    def _schedule_save(self):
+        if self._save_handle is None:
+            self._save_handle = asyncio.get_running_loop().call_later(SAVE_DELAY, self._save_later)
+
+    def _save_later(self):
+        self._save_handle = None
+        # A copy, so the writer thread never sees entries being updated.
+        asyncio.get_running_loop().run_in_executor(
+            None, self._write_validators, self._copy_validators())
+
+    def save(self):
+        """Writes pending changes now, e.g. on shutdown."""
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+            self._write_validators(self._copy_validators())
+
+    def _get_session(self):
+        # Created lazily so it binds to the running event loop, and so aiohttp
+        # is only imported once there is art to download.
+        if self._session is None or self._session.closed:
+            import aiohttp
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self._limit_per_host,
+                keepalive_timeout=60,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self._timeout))
+        return self._session
+
+    def needs_revalidation(self, url):
+        """True if cached art for `url` hasn't been checked against the origin recently."""
+        entry = self._validators.get(url)
+        if not entry:
+            return False  # Nothing to revalidate with
+        return time.time() - entry.get("checked", 0) > self._revalidate_after
+
+    async def fetch(self, url, revalidate=False):
+        """Returns the body of `url`, or None if revalidating found it unchanged.
+
+        Unchanged means a 304, or a full response with the same bytes as last time.
+        """
+        headers = {}
+        entry = self._validators.get(url)
+        if revalidate and entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        async with self._get_session().get(url, headers=headers) as response:
+            if response.status == 304:
+                entry["checked"] = time.time()
+                self._validators.move_to_end(url)
+                self._schedule_save()
+                return None
+            response.raise_for_status()
+            body = await response.read()
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+
+        digest = hashlib.md5(body).hexdigest()
+        if etag or last_modified:
+            self._validators[url] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "digest": digest,
+                "checked": time.time(),
+            }
+            self._validators.move_to_end(url)
+            self._trim_validators()
+            self._schedule_save()
+        elif self._validators.pop(url, None) is not None:
+            # The origin stopped sending validators; an old entry would keep
+            # this url due for revalidation, and re-downloaded, forever.
+            self._schedule_save()
+        if revalidate and entry and entry.get("digest") == digest:
+            return None  # A full response, but the same image as before
+        return body
+
+    async def close(self):
+        """Closes the HTTP client and writes out pending validators."""
+        if self._session is not None:
+            await self._session.close()
+        self.save()
@@ -0,0 +1,133 @@
+# state/art_processor.py
+import time
+from io import BytesIO
+
+# Pillow is imported by the functions that render, not here: the TCP and web
+# servers only need the names below, and start without paying for it.
+
+# The variant every cover gets; its file is what cover_url points at.
+DEFAULT_VARIANT = "jpeg"
+DEFAULT_VARIANT_SPEC = {"format": "jpeg", "size": (128, 128)}
+# Extension of the default variant's cache file, e.g. "<md5>.jpg".
+DEFAULT_EXTENSION = "jpg"
+
+FORMATS = ("jpeg", "rgb888", "rgb565", "rgb565le")
+FITS = ("stretch", "cover", "contain")
+
+# Let Pillow shrink by whole factors with reduce() before the final resample;
+# nearly as sharp as a full resample and much cheaper on huge covers.
+REDUCING_GAP = 2.0
+
+
+def variant_filename(cache_filename, key):
+    """Cache filename for variant `key` of the cover stored as `cache_filename`."""
+    if key == DEFAULT_VARIANT:
+        return cache_filename
+    stem = cache_filename.rsplit(".", 1)[0]
+    return f"{stem}.{key}"
+
+
+def _fit(image, size, fit):
+    from PIL import Image
+    width, height = size
+    if fit == "cover":
+        # Crop the centre to the target aspect ratio as part of the resize.
+        scale = min(image.width / width, image.height / height)
+        crop_w, crop_h = width * scale, height * scale
+        left, top = (image.width - crop_w) / 2, (image.height - crop_h) / 2
+        return image.resize(size, Image.BICUBIC, box=(left, top, left + crop_w, top + crop_h),
+                            reducing_gap=REDUCING_GAP)
+    if fit == "contain":
+        scale = min(width / image.width, height / image.height)
+        inner = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        canvas = Image.new("RGB", size, (0, 0, 0))
+        canvas.paste(image.resize(inner, Image.BICUBIC, reducing_gap=REDUCING_GAP),
+                     ((width - inner[0]) // 2, (height - inner[1]) // 2))
+        return canvas
+    return image.resize(size, Image.BICUBIC, reducing_gap=REDUCING_GAP)
+
+
+def _pack_rgb565(image, little_endian):
+    """Packs an RGB image into 16-bit 5-6-5 pixels without a per-pixel Python loop."""
+    from PIL import Image, ImageChops
+    r, g, b = image.split()
+    # The bit ranges never overlap, so adding the channels is the same as OR-ing them.
+    high = ImageChops.add(r.point(lambda v: v & 0xF8), g.point(lambda v: v >> 5))
+    low = ImageChops.add(g.point(lambda v: (v & 0x1C) << 3), b.point(lambda v: v >> 3))
+    bands = (low, high) if little_endian else (high, low)
+    return Image.merge("LA", bands).tobytes()
+
+
+def _encode(image, fmt):
+    if fmt == "jpeg":
+        output = BytesIO()
+        image.save(output, "JPEG", quality=90)
+        return output.getvalue()
+    if fmt == "rgb888":
+        return image.tobytes()
+    if fmt == "rgb565":
+        return _pack_rgb565(image, little_endian=False)
+    if fmt == "rgb565le":
+        return _pack_rgb565(image, little_endian=True)
+    raise ValueError(f"Unknown art format '{fmt}'")
+
+
+def validate_variants(variants):
+    """Checks ART_VARIANTS style config up front so bad entries fail at startup."""
+    for key, spec in variants.items():
+        if not key.isidentifier():
+            raise ValueError(f"Art variant key '{key}' must be a plain identifier")
+        if key in (DEFAULT_VARIANT, DEFAULT_EXTENSION):
+            # Either would replace the default JPEG that cover_url points at.
+            raise ValueError(f"Art variant key '{key}' is reserved for the default cover")
+        if spec.get("format") not in FORMATS:
+            raise ValueError(f"Art variant '{key}' has unknown format {spec.get('format')!r}")
+        if spec.get("fit", "stretch") not in FITS:
+            raise ValueError(f"Art variant '{key}' has unknown fit {spec.get('fit')!r}")
+        width, height = spec["size"]
+        if width <= 0 or height <= 0:
+            raise ValueError(f"Art variant '{key}' has an invalid size {spec['size']}")
+
+
+def _all_variants(variants):
+    return {DEFAULT_VARIANT: DEFAULT_VARIANT_SPEC, **variants}
+
+
+def render_variants(image, variants, timings=None):
+    """Renders every variant of an opened image, returning {key: bytes}.
+
+    The default JPEG is always included. Raw formats are row-major framebuffers
+    of width*height pixels with no header, ready to memcpy onto a panel.
+    Seconds spent resizing and encoding are added to `timings` if given.
+    """
+    timings = {} if timings is None else timings
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    rendered = {}
+    for key, spec in _all_variants(variants).items():
+        started = time.perf_counter()
+        fitted = _fit(image, tuple(spec["size"]), spec.get("fit", "stretch"))
+        resized = time.perf_counter()
+        rendered[key] = _encode(fitted, spec["format"])
+        timings["resize"] = timings.get("resize", 0) + resized - started
+        timings["encode"] = timings.get("encode", 0) + time.perf_counter() - resized
+    return rendered
+
+
+def render_source(source, variants):
+    """Decodes encoded image bytes (or a file path) and renders every variant.
+
+    JPEGs are decoded in draft mode, letting libjpeg scale by 1/2, 1/4 or 1/8
+    while decoding, down to the smallest size still covering every variant.
+    This is a plain module-level function so it can run in a worker process;
+    it returns (rendered, timings) with the seconds spent in each stage, since
+    metrics recorded inside a worker would never reach the parent.
+    """
+    from PIL import Image
+    started = time.perf_counter()
+    image = Image.open(BytesIO(source) if isinstance(source, bytes) else source)
+    sizes = [tuple(spec["size"]) for spec in _all_variants(variants).values()]
+    image.draft("RGB", (max(w for w, _ in sizes), max(h for _, h in sizes)))
+    image.load()
+    timings = {"decode": time.perf_counter() - started}
+    return render_variants(image, variants, timings), timings
@@ -1,124 +1,505 @@
 # state/session.py
-import threading
 import asyncio
-import requests
-from PIL import Image
-from io import BytesIO
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import os
 import hashlib
+import json
+import logging
+import threading
+import time
+import metrics
+from state.art_fetcher import ArtFetcher
+from state.art_cache import ArtCache
+from state.art_processor import DEFAULT_EXTENSION, DEFAULT_VARIANT, render_source, variant_filename
+
+logger = logging.getLogger(__name__)
 
 ART_CACHE_DIR = "/tmp/art_cache/"
+DEFAULT_COALESCE_WINDOW_MS = 30
+DEFAULT_ART_WORKERS = 2
+DEFAULT_RENDER_PROCESSES = 2
+PREFETCH_WORKERS = 1  # prefetches never take slots from the current track's art
+DEFAULT_SNAPSHOT_INTERVAL = 2
+# An older snapshot brings its playing zones back as paused: the player may
+# have stopped since, and e.g. Shairport says nothing until its next session.
+DEFAULT_SNAPSHOT_MAX_AGE = 60
+
+EVENT_WAIT_SECONDS = metrics.Histogram(
+    "apollo_session_event_wait_seconds", "Time a player event waited in the session queue.")
+EVENT_APPLY_SECONDS = metrics.Histogram(
+    "apollo_session_event_apply_seconds", "Time to apply one player event to the state.", ["event"])
+COALESCE_SECONDS = metrics.Histogram(
+    "apollo_session_coalesce_seconds", "Time from the first change in a burst to its broadcast.")
+COALESCED = metrics.Counter(
+    "apollo_session_coalesced_total", "State changes folded into an already scheduled broadcast.")
+FLUSHES = metrics.Counter(
+    "apollo_session_flushes_total", "Coalesced broadcasts, by whether the state had changed.", ["result"])
+ART_STAGE_SECONDS = metrics.Histogram(
+    "apollo_art_stage_seconds", "Time spent in each art pipeline stage.", ["stage"])
+ART_JOBS = metrics.Counter("apollo_art_jobs_total", "Finished art jobs, by outcome.", ["kind", "result"])
+ART_COVER_WAIT_SECONDS = metrics.Histogram(
+    "apollo_art_cover_wait_seconds", "Time from a track change to its cover being published.")
+
+
+def _read_snapshot(path):
+    """Returns (saved_at, zone -> state) from the snapshot file, or (None, {})."""
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+        zones = {str(name): dict(state) for name, state in snapshot["zones"].items()}
+        return float(snapshot["saved_at"]), zones
+    except FileNotFoundError:
+        return None, {}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        logger.warning("Ignoring unreadable state snapshot: %s", e)
+        return None, {}
+
+
+class _Zone:
+    """One room's player: its own state, broadcast schedule and art jobs."""
+
+    def __init__(self, name):
+        self.name = name
+        self.state = {"zone": name, "player_state": "stopped", "songid": None}
+        self.flush_handle = None
+        self.flush_armed_at = None
+        self.last_sent = None
+        self.art_jobs = {}  # cache filename -> Task, one in-flight job per cover
+        self.pending_cover = None  # relative url the current track is waiting on
+        self.pending_since = None
+        self.prefetch_jobs = {}  # cache filename -> Task for upcoming tracks' covers
+        self.prefetch_urls = []  # the upcoming covers those jobs were started for
+        self.prefetch_running = set()  # prefetch jobs past the slot, downloading or rendering
+        self.deferred_prefetch = None  # covers to prefetch once the current art is done
 
 
 class SessionManager:
+    """Owns the state of every zone and applies player events to it.
+
+    Each player reports under its own name, and that name is its zone: a
+    separate state, broadcast only to the boards subscribed to it, with its
+    own art jobs. Players call update_* from anywhere; the calls only enqueue
+    an event. A single task (run()) applies them in arrival order on the
+    event loop, so state is never shared between threads and needs no lock.
+    Art work runs as tasks that await the fetcher and the render executors,
+    which all zones share.
+
+    With a snapshot_path, the last sent state of every zone is written to disk
+    at most once per snapshot_interval and by save_snapshot() on shutdown.
+    restore_snapshot() brings it back after a restart, before any player has
+    reported; from a snapshot older than snapshot_max_age, playing zones
+    come back paused.
+    """
 
-    def __init__(self, tcp_server, loop):
+    def __init__(self, tcp_server, loop, coalesce_window_ms=DEFAULT_COALESCE_WINDOW_MS,
+                 art_workers=DEFAULT_ART_WORKERS, art_fetcher=None, art_cache=None,
+                 art_variants=None, render_processes=DEFAULT_RENDER_PROCESSES,
+                 snapshot_path=None, snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL,
+                 snapshot_max_age=DEFAULT_SNAPSHOT_MAX_AGE):
         self._tcp_server = tcp_server
         self._loop = loop
-        self.unified_state = {"player_state": "stopped", "songid": None}
-        self._lock = threading.Lock()
-
-    def _broadcast_state(self, state_to_send):
-        if self._tcp_server and state_to_send:
-            print(f"SESSION: Sending {state_to_send}")
-            asyncio.run_coroutine_threadsafe(
-                self._tcp_server.broadcast(state_to_send),
-                self._loop
-            )
-
-    def _getFileName(self, songid, remote_cover_url):
-        hash_object = hashlib.md5(remote_cover_url.encode())
-        cache_filename = f"{hash_object.hexdigest()}.jpg"
-        cache_filepath = os.path.join(ART_CACHE_DIR, cache_filename)
-        return (os.path.exists(cache_filepath), f"/art/{cache_filename}", cache_filepath, cache_filename)
-
-    def _process_and_cache_art(self, songid, remote_cover_url):
-        (exists, relative_url, cache_filepath,
-         cache_filename) = self._getFileName(songid, remote_cover_url)
+        self._events = asyncio.Queue()
+        self._coalesce_window = coalesce_window_ms / 1000
+        self._zones = {}
+        self._art_fetcher = art_fetcher or ArtFetcher(
+            os.path.join(ART_CACHE_DIR, "validators.json"))
+        self._art_cache = art_cache or ArtCache(ART_CACHE_DIR)
+        self._art_variants = art_variants or {}
+        self._art_slots = asyncio.Semaphore(art_workers)
+        self._render_pool = None
+        if render_processes > 0:
+            # forkserver: workers never inherit the event loop or our threads.
+            self._render_pool = ProcessPoolExecutor(
+                max_workers=render_processes,
+                mp_context=multiprocessing.get_context("forkserver"))
+        self._prefetch_slots = asyncio.Semaphore(PREFETCH_WORKERS)
+        self._snapshot_path = snapshot_path
+        self._snapshot_interval = snapshot_interval
+        self._snapshot_max_age = snapshot_max_age
+        self._snapshot_handle = None
+        self._snapshot_lock = threading.Lock()
+
+    def _zone(self, name):
+        zone = self._zones.get(name)
+        if zone is None:
+            zone = self._zones[name] = _Zone(name)
+        return zone
+
+    async def restore_snapshot(self, zones=None):
+        """Loads the last saved state of each zone and hands it to the TCP server.
+
+        Boards connecting from then on get it straight away, instead of a
+        stopped player until the real one reports. Only `zones` are restored
+        (all of them if None); covers that are no longer cached are dropped.
+        Returns the number of zones restored.
+        """
+        if not self._snapshot_path:
+            return 0
+        saved_at, snapshot = await self._loop.run_in_executor(None, _read_snapshot, self._snapshot_path)
+        stale = saved_at is not None and time.time() - saved_at > self._snapshot_max_age
+        restored = 0
+        for name, state in snapshot.items():
+            if zones is not None and name not in zones:
+                continue
+            if stale and state.get("player_state") == "playing":
+                state["player_state"] = "paused"
+            cover_url = state.get("cover_url")
+            if cover_url and not self._is_cached(cover_url.rsplit("/", 1)[-1]):
+                state["cover_url"] = None
+            zone = self._zone(name)
+            zone.state = {**state, "zone": name}
+            zone.last_sent = zone.state.copy()
+            if self._tcp_server:
+                await self._tcp_server.broadcast(zone.last_sent, name)
+            restored += 1
+        return restored
+
+    def _schedule_snapshot(self):
+        if self._snapshot_path and self._snapshot_handle is None:
+            self._snapshot_handle = self._loop.call_later(self._snapshot_interval, self._save_snapshot)
+
+    def _write_snapshot(self, zones):
+        """Atomically replaces the snapshot file with the last sent state of each zone."""
+        with self._snapshot_lock:
+            tmp_path = f"{self._snapshot_path}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump({"saved_at": time.time(), "zones": zones}, f)
+                os.replace(tmp_path, self._snapshot_path)
+            except OSError as e:
+                logger.warning("Failed to save state snapshot: %s", e)
+
+    def _snapshot_zones(self):
+        # last_sent dicts are replaced, never mutated, so the writer thread can read them.
+        return {name: zone.last_sent for name, zone in self._zones.items() if zone.last_sent}
+
+    def _save_snapshot(self):
+        self._snapshot_handle = None
+        self._loop.run_in_executor(None, self._write_snapshot, self._snapshot_zones())
+
+    def save_snapshot(self):
+        """Writes a pending snapshot now, e.g. on shutdown."""
+        if self._snapshot_handle is not None:
+            self._snapshot_handle.cancel()
+            self._snapshot_handle = None
+            self._write_snapshot(self._snapshot_zones())
+
+    def _post(self, handler, *args):
+        """Queues an event for the session task. Safe to call from any thread."""
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        event = (handler, args, time.perf_counter())
+        if on_loop:
+            self._events.put_nowait(event)
+        else:
+            self._loop.call_soon_threadsafe(self._events.put_nowait, event)
+
+    async def run(self):
+        """Applies queued player events one at a time, in the order they arrived."""
+        while True:
+            handler, args, posted_at = await self._events.get()
+            started = time.perf_counter()
+            EVENT_WAIT_SECONDS.observe(started - posted_at)
+            try:
+                handler(*args)
+            except Exception as e:
+                logger.error("Failed to apply %s: %s", handler.__name__, e)
+            EVENT_APPLY_SECONDS.labels(handler.__name__.replace("_apply_", "", 1)).observe(
+                time.perf_counter() - started)
+
+    def _broadcast_state(self, zone):
+        """Schedules a broadcast of the zone's current state.
+
+        All calls within one coalescing window collapse into a single broadcast
+        of whatever the state is when the window closes, so bursts like
+        transport+metadata+art go out as one ordered frame.
+        """
+        if not self._tcp_server:
+            return
+        if zone.flush_handle is not None:
+            COALESCED.inc()
+            return
+        zone.flush_armed_at = time.perf_counter()
+        if self._coalesce_window > 0:
+            zone.flush_handle = self._loop.call_later(self._coalesce_window, self._flush, zone)
+        else:
+            zone.flush_handle = self._loop.call_soon(self._flush, zone)
+
+    def _flush(self, zone):
+        zone.flush_handle = None
+        COALESCE_SECONDS.observe(time.perf_counter() - zone.flush_armed_at)
+        state_to_send = zone.state.copy()
+        if state_to_send == zone.last_sent:
+            FLUSHES.labels("unchanged").inc()
+            return  # The burst cancelled itself out, nothing to redraw
+        FLUSHES.labels("sent").inc()
+        zone.last_sent = state_to_send
+        # Keep zones in the order they last changed, so a restored snapshot
+        # replays them in that order and the TCP server picks the same active zone.
+        self._zones[zone.name] = self._zones.pop(zone.name)
+        logger.debug("Sending %s", state_to_send)
+        self._loop.create_task(self._tcp_server.broadcast(state_to_send, zone.name))
+        self._schedule_snapshot()
+
+    def _is_cached(self, cache_filename):
+        """True only if every variant of the cover is cached; any missing one is re-rendered."""
+        return all(self._art_cache.contains(variant_filename(cache_filename, key))
+                   for key in (DEFAULT_VARIANT, *self._art_variants))
+
+    def _getFileName(self, songid, cover_source):
+        # Remote art is keyed by its URL, embedded art by the image bytes
+        # themselves, so every track sharing a cover resolves to one entry.
+        if isinstance(cover_source, bytes):
+            hash_object = hashlib.md5(cover_source)
+        else:
+            hash_object = hashlib.md5(cover_source.encode())
+        cache_filename = f"{hash_object.hexdigest()}.{DEFAULT_EXTENSION}"
+        return (self._is_cached(cache_filename), f"/art/{cache_filename}", cache_filename)
+
+    def _apply_art(self, zone, relative_url):
+        """Publishes finished art if it is still the cover the zone is waiting for."""
+        if zone.pending_cover != relative_url:
+            return
+        zone.pending_cover = None
+        ART_COVER_WAIT_SECONDS.observe(time.perf_counter() - zone.pending_since)
+        zone.state["cover_url"] = relative_url
+        logger.info("Cover ready in '%s': %s", zone.name, relative_url)
+        self._broadcast_state(zone)
+
+    def _finish_art_job(self, zone, cache_filename):
+        if zone.art_jobs.get(cache_filename) is asyncio.current_task():
+            del zone.art_jobs[cache_filename]
+        if not zone.art_jobs and zone.deferred_prefetch is not None:
+            cover_urls, zone.deferred_prefetch = zone.deferred_prefetch, None
+            self._apply_prefetch(zone.name, cover_urls)
+
+    async def _read_cover(self, songid, cover_source):
+        """Returns what render_source() needs for a cover: image bytes or a local path."""
+        source = None
+        if isinstance(cover_source, bytes):
+            logger.debug("Processing embedded art for %s (%d bytes)", songid, len(cover_source))
+            source = cover_source
+        elif cover_source.startswith("file://"):
+            source = cover_source[7:] # Strip the "file://" prefix
+            logger.debug("Processing art for %s from local file: %s", songid, source)
+        elif cover_source.startswith("http"):
+            logger.debug("Processing art for %s from web URL: %s", songid, cover_source)
+            with ART_STAGE_SECONDS.labels("download").time():
+                source = await self._art_fetcher.fetch(cover_source)
+        return source
+
+    async def _process_and_cache_art(self, zone, songid, cover_source, cache_filename):
+        relative_url = f"/art/{cache_filename}"
+        try:
+            async with self._art_slots:
+                if self._is_cached(cache_filename):
+                    logger.debug("Art for songid %s found in cache.", songid)
+                    ART_JOBS.labels("current", "cached").inc()
+                    self._apply_art(zone, relative_url)
+                    return
+
+                source = await self._read_cover(songid, cover_source)
+                await self._render_art(source, cache_filename)
+            ART_JOBS.labels("current", "rendered").inc()
+            self._apply_art(zone, relative_url)
+        except asyncio.CancelledError:
+            ART_JOBS.labels("current", "cancelled").inc()
+            raise
+        except Exception as e:
+            ART_JOBS.labels("current", "failed").inc()
+            logger.warning("Failed to process art for songid %s: %s", songid, e)
+        finally:
+            self._finish_art_job(zone, cache_filename)
+
+    def _store_art(self, cache_filename, rendered):
+        # One batch, so contains() only reports a cover once every variant
+        # of it is in the cache, and the index is written once per cover.
+        self._art_cache.put_many(
+            [(variant_filename(cache_filename, key), data) for key, data in rendered.items()])
+
+    async def _render_art(self, source, cache_filename):
+        """Decodes and renders `source` (image bytes or a path) into the cache."""
+        # Decode/resize in another process so it never holds our GIL; without
+        # a process pool it falls back to the loop's default thread executor.
+        rendered, timings = await self._loop.run_in_executor(
+            self._render_pool, render_source, source, self._art_variants)
+        for stage, seconds in timings.items():
+            ART_STAGE_SECONDS.labels(stage).observe(seconds)
+        with ART_STAGE_SECONDS.labels("store").time():
+            await self._loop.run_in_executor(None, self._store_art, cache_filename, rendered)
+
+    async def _revalidate_art(self, zone, remote_cover_url, cache_filename):
+        """Re-downloads cached art only if the origin says it changed."""
         try:
-            if exists:
-                state_to_send = None
-                print(f"SESSION: Art for songid {songid} found in cache.")
-                with self._lock:
-                    if self.unified_state.get("cover_url") != relative_url:
-                        self.unified_state["cover_url"] = relative_url
-                        state_to_send = self.unified_state.copy()
-                self._broadcast_state(state_to_send)
-                return
-
-            print(f"SESSION: caching {remote_cover_url} for {songid}")
-
-            os.makedirs(ART_CACHE_DIR, exist_ok=True)
-
-            image = None
-            if remote_cover_url.startswith("file://"):
-                filepath = remote_cover_url[7:] # Strip the "file://" prefix
-                print(f"SESSION: Processing art for {songid} from local file: {filepath}")
-                image = Image.open(filepath)
-            elif remote_cover_url.startswith("http"):
-                print(f"SESSION: Processing art for {songid} from web URL: {remote_cover_url}")
-                img_response = requests.get(remote_cover_url, timeout=10)
-                img_response.raise_for_status()
-                image = Image.open(BytesIO(img_response.content))
-
-            resized_img = image.resize((128, 128))
-            rgb_img = resized_img.convert("RGB")
-            rgb_img.save(cache_filepath, "JPEG", quality=90)
-
-            state_to_send = None
-            with self._lock:
-                if self.unified_state.get("songid") == songid:
-                    self.unified_state["cover_url"] = relative_url
-                    print(f"SESSION: cached {relative_url}")
-                    state_to_send = self.unified_state.copy()
-            self._broadcast_state(state_to_send)
+            async with self._art_slots:
+                with ART_STAGE_SECONDS.labels("revalidate").time():
+                    content = await self._art_fetcher.fetch(remote_cover_url, revalidate=True)
+                if content is None:
+                    ART_JOBS.labels("revalidate", "unchanged").inc()
+                    return
+                ART_JOBS.labels("revalidate", "changed").inc()
+                logger.info("Art changed upstream for %s, re-caching.", remote_cover_url)
+                await self._render_art(content, cache_filename)
+            if self._tcp_server:
+                self._tcp_server.art_changed(f"/art/{cache_filename}")
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            print(f"SESSION: Failed to process art for songid {songid}: {e}")
+            logger.warning("Failed to revalidate art %s: %s", remote_cover_url, e)
+        finally:
+            self._finish_art_job(zone, cache_filename)
+
+    async def _prefetch_and_cache_art(self, zone, cover_url, cache_filename):
+        try:
+            async with self._prefetch_slots:
+                zone.prefetch_running.add(cache_filename)
+                if not self._is_cached(cache_filename):
+                    source = await self._read_cover("upcoming track", cover_url)
+                    await self._render_art(source, cache_filename)
+            ART_JOBS.labels("prefetch", "rendered").inc()
+            # The track may have started while this was still running.
+            self._apply_art(zone, f"/art/{cache_filename}")
+        except asyncio.CancelledError:
+            ART_JOBS.labels("prefetch", "cancelled").inc()
+            raise
+        except Exception as e:
+            ART_JOBS.labels("prefetch", "failed").inc()
+            logger.warning("Failed to prefetch art %s: %s", cover_url, e)
+        finally:
+            zone.prefetch_running.discard(cache_filename)
+            if zone.prefetch_jobs.get(cache_filename) is asyncio.current_task():
+                del zone.prefetch_jobs[cache_filename]
+            self._finish_art_job(zone, cache_filename)
+
+    @staticmethod
+    def _cancel_stale_art_jobs(zone, keep_filename=None):
+        """Cancels art jobs for covers nobody is waiting for, even mid-download."""
+        for cache_filename, task in list(zone.art_jobs.items()):
+            if cache_filename != keep_filename:
+                task.cancel()
+                del zone.art_jobs[cache_filename]
+
+    def _request_art(self, zone, songid, cover_source, relative_url, cache_filename):
+        """Starts art processing, sharing one job per cache file."""
+        zone.pending_cover = relative_url
+        zone.pending_since = time.perf_counter()
+        self._cancel_stale_art_jobs(zone, keep_filename=cache_filename)
+        prefetch = zone.prefetch_jobs.pop(cache_filename, None)
+        if prefetch is not None and cache_filename not in zone.art_jobs:
+            if cache_filename in zone.prefetch_running:
+                # Already downloading or rendering, with nothing ahead of it:
+                # adopt it. It publishes the cover when done and is now
+                # cancelled like any other job for the current track.
+                zone.art_jobs[cache_filename] = prefetch
+            else:
+                prefetch.cancel()  # Still queued behind another prefetch
+        # The upcoming covers wait until this one is done, see _apply_prefetch;
+        # _finish_art_job starts them again unless a newer list is waiting.
+        if zone.prefetch_jobs and zone.deferred_prefetch is None:
+            zone.deferred_prefetch = zone.prefetch_urls
+        for task in zone.prefetch_jobs.values():
+            task.cancel()
+        zone.prefetch_jobs.clear()
+        if cache_filename in zone.art_jobs:
+            return
+        zone.art_jobs[cache_filename] = self._loop.create_task(
+            self._process_and_cache_art(zone, songid, cover_source, cache_filename))
 
     def update_transport_state(self, player_name, transport_state_str):
+        self._post(self._apply_transport_state, player_name, transport_state_str)
+
+    def update_metadata(self, player_name, metadata_dict, cover_data=None):
+        """Queues new track metadata.
+
+        Players that receive the cover image itself (e.g. AirPlay PICT) pass
+        it as cover_data instead of a cover_url; it is processed in memory.
+        """
+        self._post(self._apply_metadata, player_name, metadata_dict, cover_data)
+
+    def prefetch_art(self, player_name, cover_urls):
+        """Queues covers of upcoming tracks to be cached before they play.
+
+        Prefetching runs one cover at a time on its own slot, and waits
+        while the current track's art is being fetched, so it never delays
+        the cover of the track that is playing now.
+        """
+        self._post(self._apply_prefetch, player_name, list(cover_urls))
+
+    def _apply_prefetch(self, player_name, cover_urls):
+        zone = self._zone(player_name)
+        if zone.art_jobs:
+            # The current track's art comes first; _finish_art_job picks the
+            # latest list back up once it is done.
+            zone.deferred_prefetch = cover_urls
+            return
+        zone.prefetch_urls = cover_urls
+        wanted = {}
+        for cover_url in cover_urls:
+            if not cover_url or not cover_url.startswith(("http", "file://")):
+                continue
+            (exists, _, cache_filename) = self._getFileName(None, cover_url)
+            if not exists and cache_filename not in zone.art_jobs:
+                wanted[cache_filename] = cover_url
+
+        # The upcoming list changed (skip, reorder): drop covers no longer in it.
+        for cache_filename, task in list(zone.prefetch_jobs.items()):
+            if cache_filename not in wanted:
+                task.cancel()
+                del zone.prefetch_jobs[cache_filename]
+        for cache_filename, cover_url in wanted.items():
+            if cache_filename not in zone.prefetch_jobs:
+                logger.debug("Prefetching art for an upcoming '%s' track: %s", player_name, cover_url)
+                zone.prefetch_jobs[cache_filename] = self._loop.create_task(
+                    self._prefetch_and_cache_art(zone, cover_url, cache_filename))
+
+    def _apply_transport_state(self, player_name, transport_state_str):
+        zone = self._zone(player_name)
         transport_state_str = transport_state_str.lower()
-        state_to_send = None
-        with self._lock:
-            if self.unified_state.get("player_state") == transport_state_str:
-                return
-            print(f"SESSION: {player_name} -> {transport_state_str}")
-            self.unified_state["player_state"] = transport_state_str
-
-            if transport_state_str == 'stopped':
-                self.unified_state.update(
-                    {"title": None, "artist": None, "album": None, "cover_url": None, "songid": None})
-            state_to_send = self.unified_state.copy()
-        self._broadcast_state(state_to_send)
-
-    def update_metadata(self, player_name, metadata_dict):
-        state_to_send = None
-        with self._lock:
-            new_songid = metadata_dict.get("songid")
-
-            track_changed = not new_songid or not new_songid == self.unified_state.get("songid")
-            metadata_changed = metadata_dict.get('cover_url') and not self.unified_state.get('cover_url')
-
-            if not track_changed and not metadata_changed:
-                return
-            print(f"SESSION: Received new metadata from '{player_name}'.")
-
-            # Set the new metadata
-            self.unified_state.update(metadata_dict)
-            self.unified_state["player_state"] = "playing"
-            original_cover_url = metadata_dict.get("cover_url")
-            self.unified_state["cover_url"] = None
-
-            if original_cover_url:
-                (exists, relative_url, _, _) = self._getFileName(
-                    new_songid, original_cover_url)
-                if not exists:
-                    threading.Thread(
-                        target=self._process_and_cache_art,
-                        args=(new_songid, original_cover_url),
-                        daemon=True
-                    ).start()
-                else:
-                    self.unified_state["cover_url"] = relative_url
-            state_to_send = self.unified_state.copy()
-
-        self._broadcast_state(state_to_send)
+        if zone.state.get("player_state") == transport_state_str:
+            return
+        logger.info("%s -> %s", player_name, transport_state_str)
+        zone.state["player_state"] = transport_state_str
+
+        if transport_state_str == 'stopped':
+            zone.state.update(
+                {"title": None, "artist": None, "album": None, "cover_url": None, "songid": None})
+            zone.pending_cover = None
+            self._cancel_stale_art_jobs(zone)
+        self._broadcast_state(zone)
+
+    def _apply_metadata(self, player_name, metadata_dict, cover_data):
+        zone = self._zone(player_name)
+        new_songid = metadata_dict.get("songid")
+        cover_source = cover_data or metadata_dict.get("cover_url")
+
+        track_changed = not new_songid or not new_songid == zone.state.get("songid")
+        metadata_changed = cover_source and not zone.state.get('cover_url')
+
+        if not track_changed and not metadata_changed:
+            return
+        logger.info("Received new metadata from '%s'.", player_name)
+
+        # Set the new metadata
+        zone.state.update(metadata_dict)
+        zone.state["player_state"] = "playing"
+        zone.state["cover_url"] = None
+        zone.pending_cover = None
+
+        if cover_source:
+            (exists, relative_url, cache_filename) = self._getFileName(new_songid, cover_source)
+            if not exists:
+                self._request_art(zone, new_songid, cover_source, relative_url, cache_filename)
+            else:
+                zone.state["cover_url"] = relative_url
+                self._cancel_stale_art_jobs(zone)
+                if (isinstance(cover_source, str) and cover_source.startswith("http")
+                        and self._art_fetcher.needs_revalidation(cover_source)):
+                    zone.art_jobs[cache_filename] = self._loop.create_task(
+                        self._revalidate_art(zone, cover_source, cache_filename))
+        else:
+            self._cancel_stale_art_jobs(zone)
+
+        self._broadcast_state(zone)
@@ -2,53 +2,461 @@
 import asyncio
 import struct
 import json
+import logging
+import time
+from collections import OrderedDict, deque
+from itertools import chain
+import metrics
+from state.art_processor import DEFAULT_VARIANT, variant_filename
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 4
+DEFAULT_WRITE_TIMEOUT = 5.0
+DEFAULT_HELLO_TIMEOUT = 0.25
+DEFAULT_ART_CHUNK_SIZE = 4096
+MAX_CONTROL_FRAME = 4096
+
+# Binary frames set the top bit of the length prefix; JSON frames never do.
+BINARY_FRAME_FLAG = 0x80000000
+FRAME_ART_CHUNK = 0x01
+# type, md5 digest of the art bytes, total size, offset of this chunk
+ART_CHUNK_HEADER = struct.Struct('>B16sII')
+
+# Protocol modes a board can ask for in its hello frame.
+MODE_FULL = "full"  # every frame is the complete state (legacy boards)
+MODE_DELTA = "delta"  # a snapshot, then only the fields that changed
+
+ALL_ZONES = "*"
+# Key of the combined feed that follows whichever zone last started playing,
+# for boards that name no zones; never a player zone.
+ACTIVE_ZONE = "@active"
+
+CLIENTS = metrics.Gauge("apollo_tcp_clients", "Connected boards.")
+BROADCAST_SECONDS = metrics.Histogram(
+    "apollo_tcp_broadcast_seconds", "Time to queue one state change for every board.")
+QUEUE_DEPTH = metrics.Histogram(
+    "apollo_tcp_queue_depth", "A board's queue length for a zone right after a broadcast.",
+    buckets=metrics.SIZE_BUCKETS)
+WRITE_SECONDS = metrics.Histogram(
+    "apollo_tcp_write_seconds", "Time to write and drain one frame to a board.")
+# Boards are a handful of fixed devices, so their host is a bounded label.
+SENT_BYTES = metrics.Counter("apollo_tcp_sent_bytes_total", "Bytes written to each board.", ["client"])
+SENT_FRAMES = metrics.Counter("apollo_tcp_sent_frames_total", "Frames written to each board.", ["client"])
+DROPPED = metrics.Counter(
+    "apollo_tcp_dropped_total", "Queued states a board fell too far behind to receive.", ["client"])
+FIRST_FRAME_SECONDS = metrics.Gauge(
+    "apollo_tcp_first_frame_seconds", "Time from service start to the first frame written to a board.")
+
+
+class _ZoneFeed:
+    """The latest state of one zone and the boards subscribed to it."""
+
+    def __init__(self):
+        self.seq = 0
+        self.state_data = None
+        self.full_frame = (None, None)  # (seq, encoded frame) shared by full-mode boards
+        self.subscribers = set()
+
+
+class _Client:
+    """A connected board with a bounded outbound queue per subscribed zone."""
+
+    def __init__(self, writer, queue_size):
+        self.writer = writer
+        self.addr = writer.get_extra_info('peername')
+        self.host = self.addr[0] if self.addr else "unknown"
+        self.queue_size = queue_size
+        self.pending = OrderedDict()  # zone -> deque of (seq, state_data)
+        self.wakeup = asyncio.Event()
+        self.dropped = 0
+        self.task = None
+        self.mode = MODE_FULL
+        self.negotiated = asyncio.Event()
+        # Zones named in the hello, and once subscribed the zones actually
+        # followed (None for every zone).
+        self.requested_zones = None
+        self.zones = None
+        self.subscribed = False
+        # Delta mode bookkeeping: per zone, the seq and state the board holds.
+        self.sent = {}
+        # Inline art: the variant the board asked for, the art hashes it
+        # holds, the cover each zone was last announced with, and
+        # (frame, etag, zone) entries still to send, where etag marks the
+        # frame that completes a transfer.
+        self.art_format = None
+        self.art_have = set()
+        self.art_cover = {}
+        self.art_frames = deque()
+        self.art_refresh = set()  # zones whose announced cover was re-rendered
+
+    def enqueue(self, zone, seq, state_data):
+        # Only the latest state matters to a board, so when it falls behind
+        # the oldest unsent frame of that zone makes room for the newest one,
+        # and a busy zone can never push out another zone's update. Delta
+        # boards stay consistent because deltas are computed against `sent`.
+        pending = self.pending.get(zone)
+        if pending is None:
+            pending = self.pending[zone] = deque(maxlen=self.queue_size)
+        if len(pending) == pending.maxlen:
+            self.dropped += 1
+            DROPPED.labels(self.host).inc()
+        pending.append((seq, state_data))
+        self.wakeup.set()
+
+    def next_pending(self):
+        """Pops the next (zone, seq, state_data), taking zones in turn, or None."""
+        for zone, pending in self.pending.items():
+            if pending:
+                seq, state_data = pending.popleft()
+                self.pending.move_to_end(zone)
+                return zone, seq, state_data
+        return None
 
 
 class TCPServer:
-    def __init__(self, host, port):
+    def __init__(self, host, port, queue_size=DEFAULT_QUEUE_SIZE,
+                 write_timeout=DEFAULT_WRITE_TIMEOUT,
+                 hello_timeout=DEFAULT_HELLO_TIMEOUT, art_cache=None,
+                 art_variants=None, art_chunk_size=DEFAULT_ART_CHUNK_SIZE, default_zones=None,
+                 started_at=None, zones=()):
         self._host = host
         self._port = port
+        self._queue_size = queue_size
+        self._write_timeout = write_timeout
+        self._hello_timeout = hello_timeout
+        self._art_cache = art_cache
+        self._art_formats = {DEFAULT_VARIANT, *(art_variants or {})}
+        self._art_chunk_size = art_chunk_size
+        # Zones for boards that name none in their hello; None means the
+        # active zone, the single feed boards got before there were zones.
+        self._default_zones = default_zones
         self._clients = []
-        self.state_data = None
+        # zone -> _ZoneFeed. Boards may only follow zones in here: the
+        # configured ones and any the session has broadcast.
+        self._feeds = {zone: _ZoneFeed() for zone in (ACTIVE_ZONE, *zones)}
+        self._active_zone = None
+        self._all_zones_clients = set()
+        # perf_counter() at service start; the first frame out is timed against it.
+        self._started_at = started_at
+        self._server = None
 
-    async def _handle_client(self, reader, writer):
-        addr = writer.get_extra_info('peername')
-        print(f"TCP Server: Accepted connection from {addr}")
-        self._clients.append(writer)
-        await self.broadcast(self.state_data)
+    @staticmethod
+    def _encode(message):
+        payload = json.dumps(message).encode('utf-8')
+        header = struct.pack('>I', len(payload))
+        return header + payload
+
+    def _feed(self, zone):
+        feed = self._feeds.get(zone)
+        if feed is None:
+            feed = self._feeds[zone] = _ZoneFeed()
+        return feed
+
+    def _label(self, zone):
+        """The zone name frames carry; the active feed reports the zone it follows."""
+        return self._active_zone if zone == ACTIVE_ZONE else zone
+
+    def _is_zone(self, zone):
+        return zone in self._feeds and zone != ACTIVE_ZONE
+
+    def _frame_for(self, client, zone, seq, state_data):
+        """Builds the frame a client should receive for state `seq`, or None if it has nothing new."""
+        if client.mode == MODE_FULL:
+            feed = self._feed(zone)
+            cached_seq, frame = feed.full_frame
+            if cached_seq != seq:
+                frame = self._encode(state_data)
+                feed.full_frame = (seq, frame)
+            return frame
+
+        sent = client.sent.get(zone)
+        label = self._label(zone)
+        if sent is None:
+            message = {"type": "snapshot", "zone": label, "seq": seq, "state": state_data}
+        else:
+            sent_seq, sent_state = sent
+            changes = {key: value for key, value in state_data.items()
+                       if key not in sent_state or sent_state[key] != value}
+            if not changes:
+                return None
+            message = {"type": "delta", "zone": label, "seq": seq,
+                       "base": sent_seq, "changes": changes}
+        client.sent[zone] = (seq, state_data)
+        return self._encode(message)
+
+    async def _queue_art(self, client, zone, cover_url):
+        """Queues the art frames for a zone's `cover_url`, replacing that zone's unfinished transfer."""
+        if any(entry[2] == zone for entry in client.art_frames):
+            client.art_frames = deque(entry for entry in client.art_frames if entry[2] != zone)
+        client.art_cover[zone] = cover_url
+        if not cover_url or self._art_cache is None:
+            return
+
+        filename = variant_filename(cover_url.rsplit('/', 1)[-1], client.art_format)
+        entry = self._art_cache.peek(filename)
+        if entry is None:
+            return
+        etag, data = entry
+        art_info = {"type": "art", "zone": self._label(zone), "cover_url": cover_url,
+                    "format": client.art_format, "hash": etag}
+        if etag in client.art_have:
+            client.art_frames.append((self._encode({**art_info, "cached": True}), None, zone))
+            return
+        if data is None:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(None, self._art_cache.get, filename)
+            if data is None:
+                return
+
+        client.art_frames.append(
+            (self._encode({**art_info, "cached": False, "size": len(data)}), None, zone))
+        digest = bytes.fromhex(etag)
+        view = memoryview(data)
+        for offset in range(0, len(data), self._art_chunk_size):
+            chunk = view[offset:offset + self._art_chunk_size]
+            payload = ART_CHUNK_HEADER.pack(FRAME_ART_CHUNK, digest, len(data), offset) + chunk
+            client.art_frames.append(
+                (struct.pack('>I', BINARY_FRAME_FLAG | len(payload)) + payload, None, zone))
+        # Only the last chunk completes the transfer; a superseded one never counts as held.
+        client.art_frames[-1] = (client.art_frames[-1][0], etag, zone)
+
+    async def _next_frame(self, client):
+        """Waits for the next frame, state first, interleaving art chunks in between."""
+        while True:
+            pending = client.next_pending()
+            if pending is not None:
+                zone, seq, state_data = pending
+                message = self._frame_for(client, zone, seq, state_data)
+                cover_url = state_data.get("cover_url")
+                if client.art_format and cover_url != client.art_cover.get(zone):
+                    await self._queue_art(client, zone, cover_url)
+                if message is not None:
+                    return message
+            elif client.art_refresh:
+                zone = client.art_refresh.pop()
+                await self._queue_art(client, zone, client.art_cover.get(zone))
+            elif client.art_frames:
+                frame, completed_etag, _ = client.art_frames.popleft()
+                if completed_etag:
+                    client.art_have.add(completed_etag)
+                return frame
+            else:
+                client.wakeup.clear()
+                await client.wakeup.wait()
+
+    async def _write_loop(self, client):
+        """Drains a single client's queue so a slow board only stalls itself."""
+        try:
+            await asyncio.wait_for(client.negotiated.wait(), self._hello_timeout)
+        except asyncio.TimeoutError:
+            pass  # No hello, treat it as a legacy full-state board
+        self._subscribe(client)
         try:
-            # Keep the connection alive by waiting for data that will never come
             while True:
-                data = await reader.read(100)
-                if not data:
-                    break
+                message = await self._next_frame(client)
+                started = time.perf_counter()
+                client.writer.write(message)
+                await asyncio.wait_for(client.writer.drain(), self._write_timeout)
+                WRITE_SECONDS.observe(time.perf_counter() - started)
+                SENT_BYTES.labels(client.host).inc(len(message))
+                SENT_FRAMES.labels(client.host).inc()
+                if self._started_at is not None:
+                    self._log_first_frame(client)
+        except asyncio.TimeoutError:
+            logger.warning("Client %s stalled for more than %ss, disconnecting.",
+                           client.addr, self._write_timeout)
+        except (ConnectionError, OSError) as e:
+            logger.info("Failed to write to %s: %s", client.addr, e)
+        # Aborting the transport wakes up the reader in _handle_client,
+        # which owns the rest of the cleanup.
+        client.writer.transport.abort()
+
+    def _log_first_frame(self, client):
+        elapsed = time.perf_counter() - self._started_at
+        self._started_at = None
+        FIRST_FRAME_SECONDS.set(elapsed)
+        logger.info("First frame sent to %s %.0f ms after start.", client.addr, elapsed * 1000)
+
+    def _subscribe(self, client):
+        """Attaches a board to the zones it asked for and queues their current state."""
+        zones = client.requested_zones or self._default_zones
+        if not zones:
+            client.zones = {ACTIVE_ZONE}
+            self._feeds[ACTIVE_ZONE].subscribers.add(client)
+        elif ALL_ZONES in zones:
+            client.zones = None
+            self._all_zones_clients.add(client)
+        else:
+            unknown = [zone for zone in zones if not self._is_zone(zone)]
+            if unknown:
+                logger.warning("Client %s asked for unknown zones %s, ignoring them.", client.addr, unknown)
+            client.zones = {zone for zone in zones if self._is_zone(zone)}
+            for zone in client.zones:
+                self._feeds[zone].subscribers.add(client)
+        client.subscribed = True
+        self._enqueue_current(client)
+
+    def _unsubscribe(self, client):
+        self._all_zones_clients.discard(client)
+        for zone in client.zones or ():
+            self._feeds[zone].subscribers.discard(client)
+
+    def _resubscribe(self, client):
+        """Starts a board over on its newly negotiated zones, mode and art."""
+        self._unsubscribe(client)
+        client.pending.clear()
+        client.sent.clear()
+        client.art_cover.clear()
+        client.art_frames.clear()
+        client.art_refresh.clear()
+        self._subscribe(client)
+
+    def _enqueue_current(self, client):
+        """Queues the current state of every zone the board follows."""
+        if client.zones is None:
+            zones = [zone for zone in self._feeds if zone != ACTIVE_ZONE]
+        else:
+            zones = client.zones
+        for zone in zones:
+            feed = self._feeds[zone]
+            if feed.state_data:
+                client.enqueue(zone, feed.seq, feed.state_data)
+
+    def _handle_control(self, client, message):
+        """Applies a control frame sent by a board."""
+        if not client.negotiated.is_set() and (
+                "mode" in message or "art" in message or "zones" in message):
+            mode = message.get("mode", MODE_FULL)
+            if mode in (MODE_FULL, MODE_DELTA):
+                client.mode = mode
+            art_format = message.get("art")
+            if art_format in self._art_formats and self._art_cache is not None:
+                client.art_format = art_format
+            zones = message.get("zones")
+            if isinstance(zones, str):
+                zones = [zones]
+            if isinstance(zones, list):
+                client.requested_zones = [zone for zone in zones if isinstance(zone, str)]
+            logger.info("Client %s negotiated '%s' mode, inline art: %s, zones: %s.",
+                        client.addr, client.mode, client.art_format,
+                        client.requested_zones or self._default_zones or ACTIVE_ZONE)
+            client.negotiated.set()
+            if client.subscribed:
+                # The hello came after hello_timeout, once the board had
+                # already been set up as a legacy one.
+                logger.info("Client %s sent its hello late, resubscribing.", client.addr)
+                self._resubscribe(client)
+
+        if isinstance(message.get("have"), list):
+            # Art the board already holds, by hash, so it is never re-sent.
+            client.art_have.update(h for h in message["have"] if isinstance(h, str))
+
+        if message.get("cmd") == "snapshot" and client.mode == MODE_DELTA and client.subscribed:
+            # The board saw a gap in seq numbers, resend everything.
+            client.sent.clear()
+            self._enqueue_current(client)
+
+    async def _read_loop(self, client, reader):
+        """Reads length-prefixed JSON control frames until the client goes away."""
+        while True:
+            try:
+                header = await reader.readexactly(4)
+            except asyncio.IncompleteReadError:
+                return
+            (length,) = struct.unpack('>I', header)
+            if length > MAX_CONTROL_FRAME:
+                logger.warning("Client %s sent an oversized frame (%d bytes).", client.addr, length)
+                return
+            try:
+                payload = await reader.readexactly(length)
+            except asyncio.IncompleteReadError:
+                return
+            try:
+                message = json.loads(payload)
+            except ValueError:
+                logger.warning("Ignoring malformed control frame from %s.", client.addr)
+                continue
+            if isinstance(message, dict):
+                self._handle_control(client, message)
+
+    async def _handle_client(self, reader, writer):
+        client = _Client(writer, self._queue_size)
+        logger.info("Accepted connection from %s", client.addr)
+        self._clients.append(client)
+        CLIENTS.inc()
+        client.task = asyncio.create_task(self._write_loop(client))
+        try:
+            await self._read_loop(client, reader)
         except ConnectionResetError:
-            print(f"TCP Server: Client {addr} disconnected abruptly.")
+            logger.info("Client %s disconnected abruptly.", client.addr)
         finally:
-            print(f"TCP Server: Closing connection for {addr}")
-            self._clients.remove(writer)
+            logger.info("Closing connection for %s", client.addr)
+            self._clients.remove(client)
+            self._unsubscribe(client)
+            CLIENTS.dec()
+            client.task.cancel()
             writer.close()
-            await writer.wait_closed()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def broadcast(self, state_data, zone):
+        """Sends a zone's new state to the boards following that zone.
 
-    async def broadcast(self, state_data):
+        A zone that starts playing also becomes the active zone, whose state
+        the boards following no particular zone receive.
+        """
         if not state_data:
             return
-        self.state_data = state_data
-        payload = json.dumps(state_data).encode('utf-8')
-        header = struct.pack('>I', len(payload))
-        message = header + payload
+        started = time.perf_counter()
+        feed = self._feed(zone)
+        was_playing = (feed.state_data or {}).get("player_state") == "playing"
+        self._publish(zone, state_data, chain(feed.subscribers, self._all_zones_clients))
+        # Only a change into playing takes over: metadata and cover updates of
+        # a zone that was already playing don't pull boards away from another.
+        if self._active_zone is None or (state_data.get("player_state") == "playing" and not was_playing):
+            self._active_zone = zone
+        if zone == self._active_zone:
+            self._publish(ACTIVE_ZONE, state_data, self._feeds[ACTIVE_ZONE].subscribers)
+        BROADCAST_SECONDS.observe(time.perf_counter() - started)
 
-        for writer in self._clients[:]:
-            try:
-                writer.write(message)
-                await writer.drain()
-            except ConnectionResetError:
-                print("TCP Server: Failed to broadcast to a client.")
+    def _publish(self, zone, state_data, clients):
+        feed = self._feeds[zone]
+        feed.seq += 1
+        feed.state_data = state_data
+        for client in clients:
+            client.enqueue(zone, feed.seq, state_data)
+            QUEUE_DEPTH.observe(len(client.pending[zone]))
+
+    async def listen(self):
+        """Starts accepting boards, returning as soon as the socket is bound.
+
+        Call it before the slower parts of startup so boards can connect and
+        receive restored state while the rest of the service comes up.
+        """
+        if self._server is None:
+            self._server = await asyncio.start_server(
+                self._handle_client, self._host, self._port)
+            addr = self._server.sockets[0].getsockname()
+            logger.info("Serving on %s", addr)
+
+    def art_changed(self, cover_url):
+        """Re-sends the art behind `cover_url` to boards holding it inline.
+
+        The URL stays the same when cached art is re-rendered after changing
+        upstream, so no state frame would tell those boards about it.
+        """
+        for client in self._clients:
+            if not client.art_format:
+                continue
+            for zone, announced in client.art_cover.items():
+                if announced == cover_url:
+                    client.art_refresh.add(zone)
+                    client.wakeup.set()
 
     async def start(self):
-        server = await asyncio.start_server(
-            self._handle_client, self._host, self._port)
-        addr = server.sockets[0].getsockname()
-        print(f'TCP Server: Serving on {addr}')
-        async with server:
-            await server.serve_forever()
+        await self.listen()
+        async with self._server:
+            await self._server.serve_forever()
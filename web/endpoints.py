@@ -1,11 +1,86 @@
 # web/endpoints.py
-from flask import Flask, send_from_directory
+import asyncio
+import logging
+from aiohttp import web
+import metrics
+from state.art_processor import DEFAULT_VARIANT, variant_filename
 
-app = Flask(__name__)
-ART_CACHE_DIR = "/tmp/art_cache"
+logger = logging.getLogger(__name__)
 
+# Art for a URL is re-rendered when it changes upstream, so caches must
+# check the ETag every time; unchanged art costs a 304 and no bytes.
+CACHE_CONTROL = "no-cache"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
 
-@app.route('/art/<filename>')
-def get_cached_art(filename):
-    print(f"WEB: Serving cached art: {filename}")
-    return send_from_directory(ART_CACHE_DIR, filename, mimetype='application/octet-stream')
+ART_REQUESTS = metrics.Counter("apollo_web_art_requests_total", "Art requests, by response status.", ["status"])
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate.strip('"') == etag:
+            return True
+    return False
+
+
+class WebServer:
+    """Serves processed art from the ArtCache on the main event loop."""
+
+    def __init__(self, host, port, art_cache, art_variants=None):
+        self._host = host
+        self._port = port
+        self._art_cache = art_cache
+        self._art_formats = {DEFAULT_VARIANT, *(art_variants or {})}
+        self._app = web.Application()
+        self._app.router.add_get('/art/{filename}', self.get_cached_art)
+        self._app.router.add_get('/metrics', self.get_metrics)
+
+    async def get_cached_art(self, request):
+        filename = request.match_info['filename']
+        art_format = request.query.get('format', DEFAULT_VARIANT)
+        if art_format not in self._art_formats:
+            ART_REQUESTS.labels(400).inc()
+            raise web.HTTPBadRequest(text=f"Unknown art format '{art_format}'")
+        filename = variant_filename(filename, art_format)
+        entry = self._art_cache.peek(filename)
+        if entry is None:
+            ART_REQUESTS.labels(404).inc()
+            raise web.HTTPNotFound()
+
+        etag, data = entry
+        headers = {"ETag": f'"{etag}"', "Cache-Control": CACHE_CONTROL}
+        if _etag_matches(request.headers.get("If-None-Match"), etag):
+            ART_REQUESTS.labels(304).inc()
+            return web.Response(status=304, headers=headers)
+
+        if data is None:
+            # Cold entry: load it off the loop, which also promotes it to memory.
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(None, self._art_cache.get, filename)
+            if data is None:
+                ART_REQUESTS.labels(404).inc()
+                raise web.HTTPNotFound()
+        ART_REQUESTS.labels(200).inc()
+        return web.Response(body=data, content_type='application/octet-stream',
+                            headers=headers)
+
+    async def get_metrics(self, request):
+        return web.Response(body=metrics.render().encode('utf-8'),
+                            headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+    async def start(self):
+        runner = web.AppRunner(self._app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, self._host, self._port)
+        await site.start()
+        logger.info("Serving art on %s:%s", self._host, self._port)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()